@@ -0,0 +1,18 @@
+import os
+import sys
+
+
+APP_NAME = "ArtificialMuse"
+
+
+def user_data_dir(*parts):
+    """Возвращает (и создаёт) папку приложения в профиле пользователя."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    path = os.path.join(base, APP_NAME, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+
+PARTIAL_SUFFIX = ".part"
+
+
+def _current_umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# Права новых файлов, как у open(): mkstemp создаёт файлы с правами 0600,
+# и после os.replace сохранённое изображение было бы доступно только владельцу
+FILE_MODE = 0o666 & ~_current_umask()
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def make_temp(directory, suffix=PARTIAL_SUFFIX):
+    """
+    Создаёт скрытый временный файл в папке directory с обычными правами (по umask).
+    :return: (дескриптор, путь)
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=suffix)
+    try:
+        os.chmod(tmp_path, FILE_MODE)
+    except BaseException:
+        os.close(fd)
+        remove_quietly(tmp_path)
+        raise
+    return fd, tmp_path
+
+
+def write_atomic(path, data, fsync=True):
+    """
+    Записывает байты data в path через временный файл в той же папке с атомарной
+    заменой: файл под итоговым именем либо прежний, либо записан целиком.
+    :param fsync: сбросить данные на диск до замены
+    """
+    fd, tmp_path = make_temp(os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
@@ -0,0 +1,250 @@
+import argparse
+import contextlib
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from http_session import API_URL_ENV
+from encoder import OUTPUT_FORMATS, OUTPUT_JPEG, OUTPUT_PASSTHROUGH, PRESET_FAST, PRESET_NAMES, encode_options
+
+
+DEFAULT_LEVELS = "1,2,4,8,16"
+DEFAULT_IMAGES = 48
+DEFAULT_MODELS = 4
+BENCHMARK_RATE = 1000.0  # запросов в секунду на модель: ограничитель частоты не должен влиять на замер
+
+
+def percentile(values, fraction):
+    """Процентиль методом ближайшего ранга."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """Пиковый объём резидентной памяти процесса в МБ или None, если недоступен (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux сообщает килобайты, macOS — байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_level(args):
+    """Выполняет один уровень параллельности в текущем процессе и возвращает его метрики."""
+    from engine import GenerationEngine
+    from ratelimit import rate_limiter
+    from http_session import get_pool_stats
+    from encoder import get_encode_pool
+    from logconfig import configure_logging
+
+    configure_logging(None if args.verbose else "CRITICAL", console=True, to_file=False)
+
+    rate_limiter.rate = args.rate
+    rate_limiter.burst = max(rate_limiter.burst, args.concurrency_level)
+
+    latencies = []
+
+    class TimedEngine(GenerationEngine):
+        def take_job(self, allow_model):
+            job = super().take_job(allow_model)
+            if job is not None:
+                job['started'] = time.perf_counter()
+            return job
+
+        def job_finished(self, job, future):
+            super().job_finished(job, future)
+            # Перекодируемое задание завершается только после пула кодирования
+            if 'encoding' not in job:
+                latencies.append(time.perf_counter() - job['started'])
+
+    models = [f"bench-{i}" for i in range(args.models)]
+    save_dir = tempfile.mkdtemp(prefix="artificialmuse-bench-")
+    level = args.concurrency_level
+    width, height = args.size
+    output_format = args.output_format
+    output_options = None if output_format == OUTPUT_PASSTHROUGH else encode_options(output_format, args.preset)
+    engine = TimedEngine("benchmark", width, height, models, save_dir, max(1, args.images // len(models)),
+                         max_concurrency=level, per_model_limit=level, output_format=output_format,
+                         output_options=output_options, thumbnails=args.thumbnails, max_retries=0, seed=1,
+                         use_cache=False, use_catalog=False)
+    images = []
+    engine.on_image = images.append
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    try:
+        success, fails = engine.run()
+        elapsed = time.perf_counter() - start
+        # Процессы кодирования попадают в os.times() только после завершения
+        get_encode_pool().shutdown()
+        children = os.times()
+        cpu = time.process_time() - cpu_start + children.children_user + children.children_system
+    finally:
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+    generated = len(images)
+    return {
+        'concurrency': level,
+        'requested': len(engine.sweep),
+        'generated': generated,
+        'failed': len(fails),
+        'elapsed': round(elapsed, 3),
+        'images_per_second': round(generated / elapsed, 3) if elapsed > 0 else 0.0,
+        'latency_p50': round(percentile(latencies, 0.50) or 0.0, 4),
+        'latency_p95': round(percentile(latencies, 0.95) or 0.0, 4),
+        'latency_p99': round(percentile(latencies, 0.99) or 0.0, 4),
+        'cpu_per_image_ms': round(cpu / generated * 1000, 3) if generated else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'phases': engine.timing_summary.to_dict()['overall']['mean'],
+        'output': engine.output_summary.to_dict(),
+        'new_connections': get_pool_stats()['new_connections'],
+    }
+
+
+@contextlib.contextmanager
+def stub_server(args):
+    """Запускает stub_server.py в отдельном процессе и возвращает его адрес."""
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_server.py"),
+               "--latency", args.latency, "--format", args.format, "--seed", "1"]
+    if args.error_rate:
+        command += ["--error-rate", str(args.error_rate)]
+    if args.bandwidth:
+        command += ["--bandwidth", str(args.bandwidth)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    try:
+        url = process.stdout.readline().strip()
+        if not url:
+            raise RuntimeError("Заглушка API не запустилась")
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Сравнивает результаты с сохранёнными ранее.
+    :return: список описаний регрессий
+    """
+    previous = {level['concurrency']: level for level in baseline.get('levels', [])}
+    regressions = []
+    for level in results:
+        old = previous.get(level['concurrency'])
+        if old is None:
+            continue
+        if level['images_per_second'] < old['images_per_second'] * (1 - tolerance):
+            regressions.append(f"concurrency={level['concurrency']}: images/s {old['images_per_second']} → "
+                               f"{level['images_per_second']}")
+        if old['latency_p95'] and level['latency_p95'] > old['latency_p95'] * (1 + tolerance):
+            regressions.append(f"concurrency={level['concurrency']}: p95 {old['latency_p95']} → "
+                               f"{level['latency_p95']}")
+    return regressions
+
+
+def build_parser():
+    from cli import parse_size
+
+    parser = argparse.ArgumentParser(
+        prog="benchmark.py",
+        description="Замер производительности генерации на локальной заглушке API без сети. "
+                    "Каждый уровень параллельности выполняется в отдельном процессе; итог в JSON "
+                    "выводится в stdout, таблица — в stderr.")
+    parser.add_argument("-c", "--concurrency", default=DEFAULT_LEVELS,
+                        help=f"уровни параллельности через запятую (по умолчанию {DEFAULT_LEVELS})")
+    parser.add_argument("-n", "--images", type=int, default=DEFAULT_IMAGES, help="изображений на уровень")
+    parser.add_argument("--models", type=int, default=DEFAULT_MODELS, help="число моделей")
+    parser.add_argument("-s", "--size", type=parse_size, default=(1024, 1024), help="размер ШИРИНАxВЫСОТА")
+    parser.add_argument("--latency", default="lognormal:0.2:0.5",
+                        help="распределение задержки заглушки (см. stub_server.py --help)")
+    parser.add_argument("--format", default="jpeg", help="формат ответов заглушки")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--bandwidth", type=float, default=0, help="скорость отдачи заглушки, байт/с")
+    parser.add_argument("--output-format", choices=[OUTPUT_PASSTHROUGH, *OUTPUT_FORMATS], default=OUTPUT_PASSTHROUGH,
+                        help="формат сохранения (по умолчанию ответ сервера как есть)")
+    parser.add_argument("--preset", choices=sorted(PRESET_NAMES), default=PRESET_FAST, help="профиль кодировщика")
+    parser.add_argument("--reencode", action="store_true", help="то же, что --output-format jpeg")
+    parser.add_argument("--thumbnails", action="store_true", help="создавать миниатюры, как GUI")
+    parser.add_argument("--rate", type=float, default=BENCHMARK_RATE,
+                        help="ограничение частоты клиента, запросов в секунду на модель")
+    parser.add_argument("--api-url", help="использовать уже запущенный сервер вместо заглушки")
+    parser.add_argument("--baseline", metavar="FILE", help="JSON предыдущего запуска для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="допустимое ухудшение относительно baseline (доля)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="выводить журнал генерации в stderr")
+    parser.add_argument("--concurrency-level", type=int, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.reencode and args.output_format == OUTPUT_PASSTHROUGH:
+        args.output_format = OUTPUT_JPEG
+
+    if args.concurrency_level is not None:
+        json.dump(run_level(args), sys.stdout)
+        return 0
+
+    try:
+        levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    except ValueError:
+        parser.error(f"неверный список уровней '{args.concurrency}'")
+
+    passthrough_args = [arg for arg in (argv if argv is not None else sys.argv[1:])
+                        if arg not in ("--baseline", args.baseline)]
+    results = []
+    server = contextlib.nullcontext(args.api_url) if args.api_url else stub_server(args)
+    with server as url:
+        env = dict(os.environ, **{API_URL_ENV: url})
+        for level in levels:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), *passthrough_args, "--concurrency-level", str(level)],
+                env=env, stdout=subprocess.PIPE, text=True, check=True).stdout
+            result = json.loads(output)
+            results.append(result)
+            print(f"concurrency={level:>3}  {result['images_per_second']:>8.2f} img/s  "
+                  f"p50={result['latency_p50']:.3f}s  p95={result['latency_p95']:.3f}s  "
+                  f"p99={result['latency_p99']:.3f}s  cpu/img={result['cpu_per_image_ms']} ms  "
+                  f"rss={result['peak_rss_mb']} MB  failed={result['failed']}", file=sys.stderr)
+            for output_format, output in result['output'].items():
+                print(f"    {output_format}: encode {output['encode_mean'] * 1000:.1f} ms/img, "
+                      f"{output['bytes_mean'] / 1024:.0f} KB/img", file=sys.stderr)
+
+    summary = {
+        'config': {
+            'images': args.images,
+            'models': args.models,
+            'size': f"{args.size[0]}x{args.size[1]}",
+            'latency': args.latency,
+            'format': args.format,
+            'output_format': args.output_format,
+            'preset': args.preset,
+            'thumbnails': args.thumbnails,
+        },
+        'levels': results,
+    }
+    json.dump(summary, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Регрессия: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from app_paths import user_data_dir
+from atomicfile import make_temp
+
+
+DEFAULT_CACHE_SIZE_MB = 2048
+
+
+def cache_key(prompt, params):
+    """Хэш параметров запроса, полностью определяющих результат генерации."""
+    payload = json.dumps({'prompt': prompt, **params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Дисковый кэш ответов API, адресуемый хэшем параметров запроса.
+    Хранит исходные байты изображения, ограничен по размеру и вытесняет
+    давно не использованные записи (LRU по времени последнего доступа).
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_SIZE_MB * 1024 * 1024):
+        self.directory = directory or user_data_dir("cache", "results")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = None  # key -> (path, size), порядок от давно использованных к свежим
+        self._total_bytes = 0
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                key, ext = os.path.splitext(name)
+                if len(key) != 64 or not ext:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, key, path, st.st_size))
+        found.sort()
+        self._entries = OrderedDict((key, (path, size)) for _, key, path, size in found)
+        self._total_bytes = sum(size for _, _, _, size in found)
+
+    def lookup(self, key):
+        """Возвращает путь к закэшированному файлу или None."""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(entry[0]):
+                if entry is not None:
+                    self._total_bytes -= entry[1]
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            os.utime(entry[0])  # время доступа переживает перезапуск приложения
+        except OSError:
+            pass
+        return entry[0]
+
+    def store(self, key, source_path, image_format):
+        """
+        Помещает копию файла в кэш и при необходимости вытесняет старые записи.
+        Копия, а не жёсткая ссылка: изображение пользователя можно править,
+        и правка не должна попадать в кэш.
+        """
+        shard = os.path.join(self.directory, key[:2])
+        os.makedirs(shard, exist_ok=True)
+        path = os.path.join(shard, f"{key}.{image_format}")
+        fd, tmp_path = make_temp(shard, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self._load()
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[1]
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (old_path, old_size) = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_path)
+
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+        return path
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+            self._entries = OrderedDict()
+            self._total_bytes = 0
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Общий для процесса кэш результатов генерации."""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
@@ -0,0 +1,237 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+
+from app_paths import user_data_dir
+
+
+CATALOG_BATCH_SIZE = 64  # записей в одной транзакции
+HASH_CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE,
+    directory TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    batch_id INTEGER,
+    prompt TEXT NOT NULL,
+    model TEXT NOT NULL,
+    seed INTEGER,
+    width INTEGER,
+    height INTEGER,
+    actual_width INTEGER,
+    actual_height INTEGER,
+    format TEXT,
+    bytes INTEGER,
+    sha256 TEXT,
+    latency REAL,
+    timings TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS images_directory ON images(directory, created_at);
+CREATE INDEX IF NOT EXISTS images_params ON images(prompt, model, seed, width, height);
+CREATE INDEX IF NOT EXISTS images_model ON images(model, created_at);
+CREATE INDEX IF NOT EXISTS images_sha256 ON images(sha256);
+"""
+
+COLUMNS = ("path", "directory", "created_at", "batch_id", "prompt", "model", "seed", "width", "height",
+           "actual_width", "actual_height", "format", "bytes", "sha256", "latency", "timings")
+
+logger = logging.getLogger(__name__)
+
+
+def describe_image(path):
+    """
+    Сведения о сохранённом файле: размер в байтах, SHA-256 содержимого,
+    фактические ширина, высота и формат (читается только заголовок изображения).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    with Image.open(path) as img:
+        width, height, image_format = img.width, img.height, (img.format or "").lower() or None
+    return {'bytes': size, 'sha256': digest.hexdigest(), 'actual_width': width, 'actual_height': height,
+            'format': image_format}
+
+
+class Catalog:
+    """
+    Каталог сгенерированных изображений в SQLite: путь, промпт, модель, seed,
+    запрошенный и фактический размер, объём, хэш содержимого и фазы генерации.
+    Записи добавляются через add() из потоков генерации и пишутся отдельным
+    потоком: он хэширует файлы и сохраняет накопившиеся записи одной
+    транзакцией, поэтому генерация не ждёт ни диска, ни базы.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(user_data_dir(), "catalog.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._queue = queue.SimpleQueue()
+        self._pending = 0
+        self._pending_changed = threading.Condition()
+        self._writer = None
+
+    def add(self, record):
+        """
+        Ставит результат в очередь записи. record: path, prompt, model, seed,
+        width, height (запрошенный размер), batch_id, latency и timings ({фаза: с});
+        остальные поля заполняются по файлу.
+        """
+        with self._pending_changed:
+            self._pending += 1
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="catalog-writer", daemon=True)
+                self._writer.start()
+        self._queue.put(record)
+
+    def flush(self, timeout=10.0):
+        """
+        Ждёт, пока записи из очереди попадут в базу.
+        :return: False, если время ожидания истекло
+        """
+        with self._pending_changed:
+            return self._pending_changed.wait_for(lambda: self._pending == 0, timeout)
+
+    def _write_loop(self):
+        stopping = False
+        while not stopping:
+            records = [self._queue.get()]
+            while len(records) < CATALOG_BATCH_SIZE:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in records:
+                stopping = True
+            try:
+                self.add_many(record for record in records if record is not None)
+            except Exception:
+                logger.exception("Не удалось записать %d изображений в каталог", len(records))
+            finally:
+                with self._pending_changed:
+                    self._pending -= sum(record is not None for record in records)
+                    self._pending_changed.notify_all()
+
+    def add_many(self, records):
+        """Дополняет записи сведениями о файлах и сохраняет их одной транзакцией."""
+        rows = []
+        for record in records:
+            path = os.path.abspath(record['path'])
+            try:
+                info = describe_image(path)
+            except (OSError, ValueError) as e:
+                # Файл удалён или повреждён до записи в каталог
+                logger.debug("Изображение не добавлено в каталог: %s", e, extra={'path': path})
+                continue
+            row = dict(record, **info, path=path, directory=os.path.dirname(path),
+                       created_at=record.get('created_at') or time.time(),
+                       timings=json.dumps(record.get('timings') or {}))
+            rows.append(tuple(row.get(column) for column in COLUMNS))
+        if not rows:
+            return
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO images ({', '.join(COLUMNS)}) VALUES ({placeholders})", rows)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        images = []
+        for row in rows:
+            image = dict(row)
+            image['timings'] = json.loads(image['timings'])
+            images.append(image)
+        return images
+
+    def get(self, path):
+        """Запись изображения по пути или None: параметры, чтобы повторить генерацию."""
+        images = self._query("SELECT * FROM images WHERE path = ?", (os.path.abspath(path),))
+        return images[0] if images else None
+
+    def find(self, directory=None, prompt=None, model=None, seed=None, limit=None):
+        """
+        Изображения, отобранные по папке, части промпта, модели и seed, — от новых к старым.
+        """
+        conditions, params = [], []
+        if directory is not None:
+            conditions.append("directory = ?")
+            params.append(os.path.abspath(directory))
+        if prompt is not None:
+            conditions.append("prompt LIKE ?")
+            params.append(f"%{prompt}%")
+        if model is not None:
+            conditions.append("model = ?")
+            params.append(model)
+        if seed is not None:
+            conditions.append("seed = ?")
+            params.append(seed)
+        sql = "SELECT * FROM images"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._query(sql, params)
+
+    def duplicates(self, path):
+        """Другие изображения с тем же содержимым, что и path."""
+        return self._query(
+            "SELECT * FROM images WHERE sha256 = (SELECT sha256 FROM images WHERE path = ?) AND path != ?",
+            (os.path.abspath(path),) * 2)
+
+    def remove(self, paths):
+        """Удаляет записи об удалённых файлах."""
+        try:
+            with self._lock:
+                self._conn.executemany("DELETE FROM images WHERE path = ?",
+                                       [(os.path.abspath(path),) for path in paths])
+        except sqlite3.Error as e:
+            logger.warning("Не удалось удалить записи из каталога: %s", e)
+
+    def close(self):
+        """Дописывает очередь и закрывает базу."""
+        with self._pending_changed:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+        with self._lock:
+            self._conn.close()
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Общий для процесса каталог изображений."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = Catalog()
+            atexit.register(_catalog.close)
+        return _catalog
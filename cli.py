@@ -0,0 +1,314 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from engine import GenerationEngine, DEFAULT_MAX_CONCURRENCY, DEFAULT_PER_MODEL_LIMIT
+from resilience import DEFAULT_MAX_RETRIES
+from http_session import API_URL_ENV, get_pool_stats, set_api_base_url
+from cache import get_result_cache
+from jobqueue import get_job_queue
+from sweep import SweepSpec
+from scheduler import SCHEDULING_NAMES, SCHEDULING_ROUND_ROBIN
+import metrics
+from logconfig import LOG_LEVEL_ENV, configure_logging
+from encoder import OUTPUT_FORMATS, OUTPUT_JPEG, OUTPUT_PASSTHROUGH, PRESET_FAST, PRESET_NAMES, encode_options
+
+
+DEFAULT_SIZE = "1024x1024"
+
+
+def parse_size(value):
+    """Разбирает размер вида 1920x1080."""
+    try:
+        width, height = (int(part) for part in value.lower().replace("×", "x").split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Неверный размер '{value}', ожидается ШИРИНАxВЫСОТА")
+    return width, height
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Пакетная генерация изображений без графического интерфейса. "
+                    "Итог выводится в stdout в формате JSON, журнал — в stderr.")
+    parser.add_argument("-p", "--prompt", action="append", default=[],
+                        help="описание изображения (можно указать несколько раз)")
+    parser.add_argument("-m", "--model", action="append", default=[],
+                        help="модель (можно указать несколько раз)")
+    parser.add_argument("-s", "--size", action="append", default=[], type=parse_size,
+                        help=f"размер ШИРИНАxВЫСОТА (можно указать несколько раз, по умолчанию {DEFAULT_SIZE})")
+    parser.add_argument("-n", "--count", type=int, default=1,
+                        help="изображений (seed) на каждую комбинацию промпта, размера и модели")
+    parser.add_argument("-o", "--out", default=".", help="папка сохранения")
+    parser.add_argument("--jobs", metavar="FILE",
+                        help="JSONL-файл: одна строка — один пакет с ключами prompt (или prompts), "
+                             "models, size (или sizes, width/height), count, seed (или seeds), output_dir")
+    parser.add_argument("--seed", type=int, help="фиксированный начальный seed")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help="параллельных запросов")
+    parser.add_argument("--per-model", type=int, default=DEFAULT_PER_MODEL_LIMIT,
+                        help="одновременных запросов к одной модели")
+    parser.add_argument("--retries", type=int, default=DEFAULT_MAX_RETRIES, help="повторов при ошибке")
+    parser.add_argument("--scheduling", choices=sorted(SCHEDULING_NAMES), default=SCHEDULING_ROUND_ROBIN,
+                        help="порядок моделей: round_robin — по очереди, fastest — сначала быстрые")
+    parser.add_argument("--no-cache", action="store_true", help="не использовать кэш результатов")
+    parser.add_argument("--no-catalog", action="store_true",
+                        help="не записывать результаты в каталог изображений")
+    parser.add_argument("--format", dest="output_format", choices=[OUTPUT_PASSTHROUGH, *OUTPUT_FORMATS],
+                        default=OUTPUT_PASSTHROUGH,
+                        help="формат сохранения: passthrough — ответ сервера как есть (по умолчанию)")
+    parser.add_argument("--preset", choices=sorted(PRESET_NAMES), default=PRESET_FAST,
+                        help="профиль кодировщика: fast — быстрее, small — меньше файлы")
+    parser.add_argument("--quality", type=int, help="качество JPEG и WebP (1–100)")
+    parser.add_argument("--progressive", action=argparse.BooleanOptionalAction, help="прогрессивный JPEG")
+    parser.add_argument("--webp-method", type=int, choices=range(7), metavar="0-6",
+                        help="метод WebP: 0 — быстрее, 6 — меньше")
+    parser.add_argument("--png-compress", type=int, choices=range(10), metavar="0-9", help="уровень сжатия PNG")
+    parser.add_argument("--reencode", action="store_true", help="то же, что --format jpeg")
+    parser.add_argument("--thumbnails", action="store_true",
+                        help="сохранять миниатюры в папку .thumbnails рядом с изображениями (как в GUI)")
+    parser.add_argument("--no-queue", action="store_true",
+                        help="не сохранять пакеты в очередь заданий (продолжение после сбоя будет невозможно)")
+    parser.add_argument("--resume", action="store_true", help="продолжить незавершённые пакеты из очереди")
+    parser.add_argument("--api-url", help=f"адрес API (по умолчанию из {API_URL_ENV} или Pollinations)")
+    parser.add_argument("--metrics-file", metavar="FILE",
+                        help="записывать метрики в FILE в формате OpenMetrics и JSON-снимок рядом (FILE.json)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="отдавать метрики по http://127.0.0.1:PORT/metrics и /metrics.json")
+    parser.add_argument("--log-level", metavar="LEVELS",
+                        help=f"уровни журнала, например INFO или WARNING,engine=DEBUG "
+                             f"(по умолчанию из {LOG_LEVEL_ENV} или INFO)")
+    parser.add_argument("--log-file", metavar="FILE", help="файл журнала (JSON-строки, с ротацией по размеру)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="не выводить журнал и прогресс")
+    return parser
+
+
+def parse_seeds(value, count, seed):
+    """
+    Разбирает seeds из JSONL: список или {"start": ..., "count": ...}.
+    :return: (seed_count, seed_start, seeds)
+    """
+    if value is None:
+        return count, seed, None
+    if isinstance(value, list):
+        return len(value), None, [int(s) for s in value]
+    if isinstance(value, dict):
+        return int(value.get('count', count)), value.get('start', seed), None
+    raise ValueError(f"Неверное значение seeds: {value!r}")
+
+
+def load_jobs_file(path, args):
+    """Читает описания пакетов из JSONL-файла, подставляя недостающие значения из аргументов."""
+    specs = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: {e}")
+            prompts = entry.get('prompts') or ([entry['prompt']] if entry.get('prompt') else [])
+            if not prompts:
+                raise ValueError(f"{path}:{line_number}: не указан prompt")
+
+            models = entry.get('models') or ([entry['model']] if entry.get('model') else args.model)
+            if 'width' in entry and 'height' in entry:
+                sizes = [(int(entry['width']), int(entry['height']))]
+            elif entry.get('sizes'):
+                sizes = [parse_size(size) for size in entry['sizes']]
+            elif entry.get('size'):
+                sizes = [parse_size(entry['size'])]
+            else:
+                sizes = args.size or [parse_size(DEFAULT_SIZE)]
+
+            try:
+                seed_count, seed_start, seeds = parse_seeds(
+                    entry.get('seeds'), int(entry.get('count', args.count)), entry.get('seed', args.seed))
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"{path}:{line_number}: {e}")
+            specs.append({
+                'sweep': SweepSpec(prompts, models, sizes, seed_count=seed_count, seed_start=seed_start, seeds=seeds),
+                'output_dir': entry.get('output_dir', args.out),
+            })
+    return specs
+
+
+def specs_from_args(args):
+    if not args.prompt:
+        return []
+    sizes = args.size or [parse_size(DEFAULT_SIZE)]
+    return [{
+        'sweep': SweepSpec(args.prompt, args.model, sizes, seed_count=args.count, seed_start=args.seed),
+        'output_dir': args.out,
+    }]
+
+
+def run_engine(engine):
+    """
+    Запускает генератор в отдельном потоке, чтобы Ctrl+C корректно останавливал пакет:
+    выполняемые запросы обрываются, а сводка уже выполненной части сохраняется.
+    Исключение engine.run() передаётся вызывающему.
+    :return: (результат engine.run(), прерван ли пакет)
+    """
+    result = {}
+    done = threading.Event()
+
+    def target():
+        try:
+            result['outcome'] = engine.run()
+        except BaseException as e:
+            result['error'] = e
+        finally:
+            done.set()
+
+    thread = threading.Thread(target=target, name="generation")
+    thread.start()
+    interrupted = False
+    try:
+        while not done.wait(0.2):
+            pass
+    except KeyboardInterrupt:
+        interrupted = True
+        engine.stop()
+        # Не thread.join(): прерванный сигналом join может вернуться раньше завершения потока
+        done.wait()
+    if 'error' in result:
+        raise result['error']
+    return result['outcome'], interrupted
+
+
+def run_batch(engine, label, quiet):
+    paths = []
+    engine.on_image = paths.append
+    if not quiet:
+        engine.on_progress = lambda percent: print(f"[{label}] {percent}%", file=sys.stderr)
+
+    start = time.perf_counter()
+    (success, fails), interrupted = run_engine(engine)
+    elapsed = time.perf_counter() - start
+    return {
+        'batch_id': engine.batch_id,
+        'prompts': engine.sweep.prompts,
+        'models': engine.sweep.models,
+        'sizes': [f"{width}x{height}" for width, height in engine.sweep.sizes],
+        'output_dir': engine.save_dir,
+        'requested': len(engine.sweep),
+        'generated': len(paths),
+        'failed': len(fails),
+        'success': success,
+        'interrupted': interrupted,
+        'jobs': engine.jobs_summary(),
+        'elapsed': round(elapsed, 3),
+        'images': paths,
+        'fails': fails,
+        'timing': engine.timing_summary.to_dict(),
+        'output': engine.output_summary.to_dict(),
+    }
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    try:
+        specs = load_jobs_file(args.jobs, args) if args.jobs else specs_from_args(args)
+    except (OSError, ValueError, argparse.ArgumentTypeError) as e:
+        parser.error(str(e))
+    if not specs and not args.resume:
+        parser.error("укажите --prompt, --jobs или --resume")
+    for spec in specs:
+        if not spec['sweep'].models:
+            parser.error(f"для промпта '{spec['sweep'].prompts[0]}' не указаны модели (--model)")
+
+    # Журнал пишется в stderr и файл, в stdout остаётся только итоговый JSON
+    try:
+        configure_logging(args.log_level, args.log_file, console=not args.quiet)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.reencode and args.output_format == OUTPUT_PASSTHROUGH:
+        args.output_format = OUTPUT_JPEG
+    output_options = None
+    if args.output_format != OUTPUT_PASSTHROUGH:
+        output_options = encode_options(args.output_format, args.preset, quality=args.quality,
+                                        progressive=args.progressive, method=args.webp_method,
+                                        compress_level=args.png_compress)
+
+    if args.api_url:
+        set_api_base_url(args.api_url)
+    if args.metrics_port is not None:
+        try:
+            port = metrics.exporter.start_server(args.metrics_port)
+        except OSError as e:
+            parser.error(f"не удалось открыть порт метрик {args.metrics_port}: {e}")
+        print(f"Метрики: http://127.0.0.1:{port}/metrics", file=sys.stderr)
+    if args.metrics_file:
+        metrics.exporter.start_file_export(args.metrics_file)
+    job_queue = None if args.no_queue else get_job_queue()
+    engines = []
+    if args.resume and job_queue is not None:
+        for batch in job_queue.unfinished_batches():
+            if batch['remaining']:
+                engines.append(GenerationEngine.from_batch(job_queue, batch['id']))
+    for spec in specs:
+        os.makedirs(spec['output_dir'], exist_ok=True)
+        sweep = spec['sweep']
+        width, height = sweep.sizes[0]
+        engines.append(GenerationEngine(
+            sweep.prompts[0], width, height, sweep.models, spec['output_dir'], sweep.seed_count,
+            max_concurrency=args.concurrency,
+            per_model_limit=args.per_model,
+            output_format=args.output_format,
+            output_options=output_options,
+            thumbnails=args.thumbnails,
+            max_retries=args.retries,
+            seed=sweep.seed_start,
+            use_cache=not args.no_cache,
+            use_catalog=not args.no_catalog,
+            scheduling=args.scheduling,
+            job_queue=job_queue,
+            sweep=sweep))
+
+    batches = []
+    start = time.perf_counter()
+    interrupted = False
+    for number, engine in enumerate(engines, 1):
+        try:
+            batch = run_batch(engine, f"{number}/{len(engines)}", args.quiet)
+        except KeyboardInterrupt:
+            interrupted = True
+            break
+        batches.append(batch)
+        if batch['interrupted']:
+            interrupted = True
+            break
+    elapsed = time.perf_counter() - start
+    metrics.exporter.stop_file_export()
+
+    generated = sum(b['generated'] for b in batches)
+    failed = sum(b['failed'] for b in batches)
+    summary = {
+        'batches': batches,
+        'generated': generated,
+        'failed': failed,
+        'interrupted': interrupted,
+        'elapsed': round(elapsed, 3),
+        'images_per_second': round(generated / elapsed, 3) if elapsed > 0 else 0.0,
+        'pool': get_pool_stats(),
+        'cache': None if args.no_cache else get_result_cache().stats(),
+    }
+    json.dump(summary, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+
+    if interrupted:
+        return 130
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
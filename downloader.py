@@ -1,11 +1,14 @@
 import sys
 import os
-import requests
-import random
-import datetime
-from PIL import Image
-from io import BytesIO
-from PySide6.QtCore import QThread, Signal
+import threading
+from PySide6.QtCore import QObject, QTimer, Signal
+
+from engine import GenerationEngine
+from scheduler import PRIORITY_NORMAL, get_batch_scheduler
+
+
+COALESCE_INTERVAL_MS = 50  # окно, за которое прогресс и новые изображения передаются одним сигналом
+COALESCE_MAX_IMAGES = 64   # при таком числе накопленных изображений они отправляются, не дожидаясь окна
 
 
 def resource_path(relative_path):
@@ -16,119 +19,134 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
-class DownloadImageWorker(QThread):
+class DownloadImageWorker(QObject):
+    """
+    Передаёт события пакета GenerationEngine через сигналы Qt. Пакет
+    выполняется общим планировщиком вместе с другими пакетами; сигналы
+    отправляются из потока планировщика и доставляются в поток интерфейса.
+
+    Прогресс и новые изображения накапливаются и отправляются не чаще раза
+    в COALESCE_INTERVAL_MS: пакет из кэша может давать сотни изображений в
+    секунду, и сигнал на каждое из них загружал бы цикл событий интерфейса.
+    Воркер должен жить в потоке с циклом событий (потоке интерфейса).
+    """
+
     progress = Signal(int)
-    finished = Signal(bool, list)
-    image_generated = Signal(str)
+    finished = Signal(bool, list, dict)  # успех, ошибки, сводка пакета (фазы по моделям)
+    images_generated = Signal(list)  # пути новых изображений, накопленные за окно
+    drafts_generated = Signal(list)  # [(путь черновика, задание: prompt, model, seed, width, height)]
+    drafts_finalized = Signal(list)  # [(путь черновика, путь итогового изображения)]
     error_occurred = Signal(str)
+    bytes_progress = Signal(int, int)  # получено байт, ожидается байт (по Content-Length)
+    timing = Signal(str, dict)  # модель, длительности фаз задания в секундах
+    _flush_requested = Signal()
 
-    def __init__(self, prompt, final_width, final_height, models, save_dir, count):
+    def __init__(self, *args, engine=None, priority=PRIORITY_NORMAL, **kwargs):
         super().__init__()
-        self.prompt = prompt
-        self.final_width = final_width
-        self.final_height = final_height
-        self.models = models
-        self.save_dir = save_dir
-        self.count = count
-        self._is_running = True
-
-    def run(self):
-        fails = []
-        try:
-            total = len(self.models) * self.count
-            if total == 0:
-                self.finished.emit(True, [])
+        self.engine = engine or GenerationEngine(*args, **kwargs)
+        self.priority = priority
+        self.cancelled = False
+        self._pending_lock = threading.Lock()
+        self._pending_images = []
+        self._pending_drafts = []
+        self._pending_finals = []
+        self._final_paths = set()
+        self._pending_progress = None
+        self._flush_scheduled = False
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(COALESCE_INTERVAL_MS)
+        self._flush_timer.timeout.connect(self.flush_pending)
+        # Сигнал из потока планировщика доставляется в поток воркера, где и запускается таймер
+        self._flush_requested.connect(self._flush_timer.start)
+        self.engine.on_progress = self._queue_progress
+        self.engine.on_image = self._queue_image
+        self.engine.on_draft = self._queue_draft
+        self.engine.on_final = self._queue_final
+        self.engine.on_error = self.error_occurred.emit
+        self.engine.on_bytes = self.bytes_progress.emit
+        self.engine.on_timing = self.timing.emit
+        self.engine.on_finished = self._finish
+
+    @classmethod
+    def from_batch(cls, job_queue, batch_id, priority=PRIORITY_NORMAL):
+        """Создаёт воркер, продолжающий незавершённый пакет из очереди заданий."""
+        return cls(engine=GenerationEngine.from_batch(job_queue, batch_id), priority=priority)
+
+    def start(self, scheduler=None):
+        """Передаёт пакет планировщику (по умолчанию — общему для процесса)."""
+        scheduler = scheduler or get_batch_scheduler(self.engine.max_concurrency, self.engine.per_model_limit)
+        scheduler.submit(self.engine, self.priority)
+
+    def set_priority(self, priority):
+        self.priority = priority
+        if self.engine.scheduler is not None:
+            self.engine.scheduler.set_priority(self.engine, priority)
+
+    def _queue_image(self, path):
+        images = None
+        with self._pending_lock:
+            if path in self._final_paths:
+                # Итоговое изображение заменяет свой черновик и передаётся через drafts_finalized
+                self._final_paths.discard(path)
                 return
-
-            done = 0
-
-            for model in self.models:
-                if not self._is_running: break
-                for i in range(1, self.count + 1):
-                    if not self._is_running: break
-                    try:
-                        seed = random.randint(1, 1000000)
-                        encoded_prompt = requests.utils.quote(self.prompt)
-                        url = f"https://image.pollinations.ai/prompt/{encoded_prompt}"
-
-                        params = {
-                            "model": model,
-                            "seed": seed,
-                            "width": self.final_width,
-                            "height": self.final_height,
-                            "nologo": "true"
-                        }
-                        print(f"Запрос: {url} с параметрами {params}")
-
-                        r = requests.get(url, params=params, timeout=60, stream=True)
-
-                        r.raise_for_status()
-
-                        content_type = r.headers.get('content-type')
-                        if content_type and 'image' in content_type:
-                            img = Image.open(BytesIO(r.content))
-                            safe_model_name = "".join(c if c.isalnum() else "_" for c in model)
-                            timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-                            filename = f"generated_{safe_model_name}_{timestamp}_{i}.jpg"
-                            path = os.path.join(self.save_dir, filename)
-                            img.save(path, quality=95)
-
-                            self.image_generated.emit(path)
-
-                            done += 1
-                            percent = int(done / total * 100)
-                            self.progress.emit(percent)
-                        else:
-                            error_message = f"Модель '{model}' (попытка {i}) вернула не изображение (Content-Type: {content_type}). Ответ:\n{r.text[:200]}..."
-                            print(error_message)
-                            self.error_occurred.emit(error_message)
-                            fails.append({
-                                'model': model,
-                                'count': i,
-                                'error': f"Неверный Content-Type: {content_type}"
-                            })
-
-
-                    except requests.exceptions.Timeout:
-                        error_message = f"Модель '{model}' (попытка {i}): Время ожидания запроса истекло."
-                        print(error_message)
-                        self.error_occurred.emit(error_message)
-                        fails.append({
-                            'model': model,
-                            'count': i,
-                            'error': "Timeout"
-                        })
-                    except requests.exceptions.RequestException as e:
-                        error_message = f"Модель '{model}' (попытка {i}): Ошибка сети/HTTP: {e}"
-                        print(error_message)
-                        self.error_occurred.emit(error_message)
-                        fails.append({
-                            'model': model,
-                            'count': i,
-                            'error': str(e)
-                        })
-                    except Exception as e:
-                        error_message = f"Модель '{model}' (попытка {i}): Неожиданная ошибка: {e}"
-                        print(error_message)
-                        self.error_occurred.emit(error_message)
-                        fails.append({
-                            'model': model,
-                            'count': i,
-                            'error': str(e)
-                        })
-
-                if not self._is_running: break
-
-            final_success = done > 0 and self._is_running
-            self.finished.emit(final_success, fails)
-
-        except Exception as e:
-            error_message = f"Критическая ошибка в потоке генерации: {e}"
-            print(error_message)
-            self.error_occurred.emit(error_message)
-            self.finished.emit(False, [{'model': 'N/A', 'count': 0, 'error': str(e)}])
-
-    def stop(self):
-        """Метод для запроса остановки потока."""
-        print("Запрос на остановку потока...")
-        self._is_running = False
+            self._pending_images.append(path)
+            if len(self._pending_images) >= COALESCE_MAX_IMAGES:
+                images, self._pending_images = self._pending_images, []
+            schedule, self._flush_scheduled = not self._flush_scheduled, True
+        if images:
+            self.images_generated.emit(images)
+        if schedule:
+            self._flush_requested.emit()
+
+    def _queue_draft(self, path, job):
+        with self._pending_lock:
+            self._pending_drafts.append((path, job))
+            schedule, self._flush_scheduled = not self._flush_scheduled, True
+        if schedule:
+            self._flush_requested.emit()
+
+    def _queue_final(self, draft_path, path):
+        with self._pending_lock:
+            self._pending_finals.append((draft_path, path))
+            self._final_paths.add(path)
+            schedule, self._flush_scheduled = not self._flush_scheduled, True
+        if schedule:
+            self._flush_requested.emit()
+
+    def _queue_progress(self, value):
+        with self._pending_lock:
+            self._pending_progress = value
+            schedule, self._flush_scheduled = not self._flush_scheduled, True
+        if schedule:
+            self._flush_requested.emit()
+
+    def flush_pending(self):
+        """Отправляет накопленные черновики, изображения и последний прогресс."""
+        with self._pending_lock:
+            drafts, self._pending_drafts = self._pending_drafts, []
+            finals, self._pending_finals = self._pending_finals, []
+            images, self._pending_images = self._pending_images, []
+            progress, self._pending_progress = self._pending_progress, None
+            self._flush_scheduled = False
+        if drafts:
+            self.drafts_generated.emit(drafts)
+        if finals:
+            self.drafts_finalized.emit(finals)
+        if images:
+            self.images_generated.emit(images)
+        if progress is not None:
+            self.progress.emit(progress)
+
+    def _finish(self, success, failed_images, summary):
+        # Всё накопленное должно прийти раньше сигнала о завершении
+        self.flush_pending()
+        self.finished.emit(success, failed_images, summary)
+
+    def stop(self, resumable=False):
+        """
+        Отменяет пакет: новые задания не запускаются, выполняемые прерываются.
+        :param resumable: оставить пакет незавершённым в очереди заданий (см. GenerationEngine.stop)
+        """
+        self.cancelled = True
+        self.engine.stop(resumable)
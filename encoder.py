@@ -0,0 +1,232 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+
+from atomicfile import write_atomic
+from thumbnails import remove_thumbnail, save_thumbnail, make_thumbnail
+
+
+QUEUE_PER_WORKER = 2  # сколько файлов на процесс может ждать кодирования, прежде чем загрузки приостановятся
+
+OUTPUT_PASSTHROUGH = "passthrough"
+OUTPUT_JPEG = "jpeg"
+OUTPUT_WEBP = "webp"
+OUTPUT_PNG = "png"
+
+PRESET_FAST = "fast"
+PRESET_SMALL = "small"
+
+PRESET_NAMES = {
+    PRESET_FAST: "Быстрее",
+    PRESET_SMALL: "Меньше",
+}
+
+# Форматы сохранения: формат Pillow, расширение и настройки кодировщика для профилей
+OUTPUT_FORMATS = {
+    OUTPUT_JPEG: {
+        'name': "JPEG",
+        'pil_format': "JPEG",
+        'extension': "jpg",
+        'parameters': ("quality", "progressive"),
+        'presets': {
+            PRESET_FAST: {'quality': 90, 'progressive': False},
+            PRESET_SMALL: {'quality': 82, 'progressive': True, 'optimize': True},
+        },
+    },
+    OUTPUT_WEBP: {
+        'name': "WebP",
+        'pil_format': "WEBP",
+        'extension': "webp",
+        'parameters': ("quality", "method"),
+        'presets': {
+            PRESET_FAST: {'quality': 85, 'method': 0},
+            PRESET_SMALL: {'quality': 80, 'method': 6},
+        },
+    },
+    OUTPUT_PNG: {
+        'name': "PNG",
+        'pil_format': "PNG",
+        'extension': "png",
+        'parameters': ("compress_level",),
+        'presets': {
+            PRESET_FAST: {'compress_level': 1},
+            PRESET_SMALL: {'compress_level': 9},
+        },
+    },
+}
+
+OUTPUT_NAMES = {OUTPUT_PASSTHROUGH: "Как есть (без перекодирования)",
+                **{key: spec['name'] for key, spec in OUTPUT_FORMATS.items()}}
+
+# Формат для ответов, которые нельзя сохранить как есть (формат не распознан)
+FALLBACK_OUTPUT = OUTPUT_JPEG
+
+logger = logging.getLogger(__name__)
+
+
+def encode_options(output_format, preset=PRESET_FAST, **overrides):
+    """
+    Настройки кодировщика для формата: профиль preset, дополненный явно
+    заданными значениями. Значения, которые формат не поддерживает
+    (например, quality для PNG) или равные None, пропускаются.
+    """
+    spec = OUTPUT_FORMATS[output_format]
+    options = dict(spec['presets'][preset])
+    options.update({key: value for key, value in overrides.items()
+                    if value is not None and key in spec['parameters']})
+    return options
+
+
+def default_encode_workers():
+    return max(1, os.cpu_count() or 1)
+
+
+def encode_file(source_path, path, output_format=OUTPUT_JPEG, options=None, thumbnail=False):
+    """
+    Декодирует source_path и записывает его в path в формате output_format
+    через временный файл с атомарной заменой. Выполняется в процессе пула
+    кодирования (или в вызывающем потоке, если пул недоступен).
+    :param options: настройки кодировщика; по умолчанию профиль PRESET_FAST
+    :param thumbnail: сохранить и миниатюру из уже декодированного изображения
+    :return: {'decode': с, 'encode': с, 'write': с, 'thumbnail': с}
+    """
+    pil_format = OUTPUT_FORMATS[output_format]['pil_format']
+    options = encode_options(output_format) if options is None else options
+    started = time.perf_counter()
+    with Image.open(source_path) as img:
+        img.load()
+        if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif pil_format == "WEBP" and img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+        decoded = time.perf_counter()
+        buffer = io.BytesIO()
+        img.save(buffer, format=pil_format, **options)
+        encoded = time.perf_counter()
+        if thumbnail:
+            save_thumbnail(img, path)
+    thumbnailed = time.perf_counter()
+
+    try:
+        write_atomic(path, buffer.getbuffer())
+    except BaseException:
+        if thumbnail:
+            remove_thumbnail(path)
+        raise
+    return {'decode': decoded - started, 'encode': encoded - decoded,
+            'write': time.perf_counter() - thumbnailed, 'thumbnail': thumbnailed - encoded}
+
+
+class OutputSummary:
+    """Сводка по форматам сохранения: число файлов, время кодирования и записанные байты."""
+
+    def __init__(self):
+        self._formats = {}
+
+    def add(self, output_format, encode_seconds, size):
+        entry = self._formats.setdefault(output_format, {'count': 0, 'encode': 0.0, 'bytes': 0})
+        entry['count'] += 1
+        entry['encode'] += encode_seconds
+        entry['bytes'] += size
+
+    def to_dict(self):
+        return {output_format: {
+            'count': entry['count'],
+            'encode_mean': round(entry['encode'] / entry['count'], 4),
+            'bytes_mean': round(entry['bytes'] / entry['count']),
+            'bytes_total': entry['bytes'],
+        } for output_format, entry in self._formats.items()}
+
+
+class EncodePool:
+    """
+    Пул процессов для декодирования и кодирования изображений, чтобы тяжёлое
+    сжатие больших кадров не занимало потоки загрузки и не конкурировало за
+    GIL с потоком интерфейса. Очередь перед пулом ограничена: когда в ней
+    workers * QUEUE_PER_WORKER файлов, submit ждёт, и загрузки приостанавливаются.
+    Процессы запускаются при первом обращении; если пул недоступен,
+    кодирование выполняется в вызывающем потоке.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or default_encode_workers()
+        self._slots = threading.BoundedSemaphore(self.workers * QUEUE_PER_WORKER)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._broken = False
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None and not self._broken:
+                try:
+                    # spawn: дочерний процесс не наследует потоки Qt, HTTP и планировщика
+                    self._executor = ProcessPoolExecutor(self.workers,
+                                                         mp_context=multiprocessing.get_context("spawn"))
+                except (OSError, ValueError, NotImplementedError) as e:
+                    logger.warning("Пул кодирования недоступен, кодирование в потоках загрузки: %s", e)
+                    self._broken = True
+            return self._executor
+
+    def submit(self, source_path, path, output_format=OUTPUT_JPEG, options=None, stop_event=None,
+               thumbnail=False):
+        """
+        Ставит файл в очередь кодирования, при заполненной очереди ждёт места.
+        :return: Future с результатом encode_file или None, если ожидание прервано stop_event
+        """
+        return self._submit(encode_file, (source_path, path, output_format, options, thumbnail), stop_event)
+
+    def submit_thumbnail(self, image_path, stop_event=None):
+        """
+        Ставит в очередь создание миниатюры уже сохранённого файла.
+        :return: Future с результатом thumbnails.make_thumbnail или None, если ожидание прервано stop_event
+        """
+        return self._submit(make_thumbnail, (image_path,), stop_event)
+
+    def _submit(self, fn, args, stop_event):
+        while not self._slots.acquire(timeout=0.1):
+            if stop_event is not None and stop_event.is_set():
+                return None
+        try:
+            executor = self._get_executor()
+            if executor is not None:
+                future = executor.submit(fn, *args)
+            else:
+                future = Future()
+                future.set_result(fn(*args))
+        except BrokenProcessPool as e:
+            self._slots.release()
+            logger.warning("Пул кодирования остановлен, кодирование в потоках загрузки: %s", e)
+            with self._lock:
+                self._broken, self._executor = True, None
+            return self._submit(fn, args, stop_event)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+_encode_pool = None
+_encode_pool_lock = threading.Lock()
+
+
+def get_encode_pool():
+    """Общий для процесса пул кодирования по числу ядер."""
+    global _encode_pool
+    with _encode_pool_lock:
+        if _encode_pool is None:
+            _encode_pool = EncodePool()
+        return _encode_pool
@@ -0,0 +1,970 @@
+import os
+import requests
+import shutil
+from urllib.parse import urlparse
+import datetime
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+from http_session import (RequestCanceller, cancellable, get_api_base_url, get_session, get_pool_stats,
+                          take_connect_time)
+from resilience import RetryPolicy, CircuitOpenError, DEFAULT_MAX_RETRIES, circuit_breaker, is_retryable
+from ratelimit import ThrottledError, THROTTLE_STATUSES, parse_retry_after, rate_limiter
+from atomicfile import make_temp, remove_quietly
+from cache import cache_key, get_result_cache
+from singleflight import inflight_requests
+from jobqueue import DONE, BATCH_DONE, BATCH_CANCELLED
+from sweep import SweepSpec, spec_from_dict
+from scheduler import BatchScheduler, SCHEDULING_ROUND_ROBIN, model_latency, order_models
+from timing import RequestTiming, TimingSummary
+from encoder import (OUTPUT_FORMATS, OUTPUT_JPEG, OUTPUT_PASSTHROUGH, FALLBACK_OUTPUT, OutputSummary,
+                     encode_file, get_encode_pool)
+from thumbnails import make_thumbnail
+from catalog import get_catalog
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_PER_MODEL_LIMIT = 2
+
+CHUNK_SIZE = 64 * 1024
+BYTES_PROGRESS_INTERVAL = 0.1  # секунд между сигналами bytes_progress
+MAX_THROTTLE_REQUEUES = 20     # сколько раз задание можно вернуть в очередь из-за 429/503
+MIN_LOOKAHEAD = 64             # минимальный запас заданий, выбранных из сетки параметров
+
+DRAFT_AUTO = "auto"  # итоговое изображение запрашивается сразу после черновика
+DRAFT_KEEP = "keep"  # итоговые изображения — только для черновиков, выбранных пользователем
+DRAFT_NAMES = {
+    None: "Без черновиков",
+    DRAFT_AUTO: "Черновик, затем итоговое",
+    DRAFT_KEEP: "Только черновики",
+}
+DRAFT_MAX_SIDE = 512  # большая сторона черновика; задания не больше этого размера выполняются сразу
+DRAFT_DIR = "drafts"
+
+
+def draft_size(width, height, max_side=DRAFT_MAX_SIDE):
+    """Размер черновика с теми же пропорциями, кратный 8."""
+    scale = min(1.0, max_side / max(width, height))
+    return max(64, round(width * scale / 8) * 8), max(64, round(height * scale / 8) * 8)
+
+
+def sniff_image_format(data):
+    """Определяет формат изображения по сигнатуре. Возвращает расширение файла или None."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return None
+
+
+def download_to_temp(chunks, directory, on_chunk=None, timing=None):
+    """
+    Потоково записывает тело ответа во временный файл в целевой папке и делает fsync.
+    :param chunks: итератор блоков байтов
+    :param on_chunk: вызывается с размером каждого полученного блока
+    :param timing: RequestTiming, куда записываются фазы transfer и write
+    :return: (путь к временному файлу, расширение по сигнатуре или None)
+    """
+    timing = timing or RequestTiming()
+    write_time = 0.0
+    fd, tmp_path = make_temp(directory)
+    try:
+        head = b""
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                started = time.perf_counter()
+                f.write(chunk)
+                write_time += time.perf_counter() - started
+                if on_chunk:
+                    on_chunk(len(chunk))
+            started = time.perf_counter()
+            f.flush()
+            os.fsync(f.fileno())
+            write_time += time.perf_counter() - started
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+    timing.add("write", write_time)
+    timing.lap("transfer", exclude=write_time)
+    return tmp_path, sniff_image_format(head)
+
+
+def copy_to_temp(source_path, directory):
+    """
+    Копирует source_path во временный файл в папке directory. Копия, а не жёсткая
+    ссылка: сохранённое изображение не должно быть тем же файлом, что запись кэша.
+    """
+    fd, tmp_path = make_temp(directory)
+    os.close(fd)
+    try:
+        shutil.copyfile(source_path, tmp_path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+    return tmp_path
+
+
+def _add_encode_phases(timing, phases):
+    """Переносит фазы encode_file или make_thumbnail в timing; остаток времени с последней отметки — ожидание очереди."""
+    timing.lap("queue", exclude=sum(phases.values()))
+    for phase, seconds in phases.items():
+        timing.add(phase, seconds)
+
+
+def finalize_image(tmp_path, base_path, image_format, output_format=OUTPUT_PASSTHROUGH, options=None,
+                   timing=None, encoder=None, stop_event=None, thumbnail=False):
+    """
+    Атомарно переносит временный файл под итоговое имя, поэтому недокачанный
+    файл никогда не появляется в папке сохранения.
+    При OUTPUT_PASSTHROUGH байты сохраняются как есть с расширением, соответствующим
+    формату; перекодирование выполняется, только если формат не распознан
+    (в FALLBACK_OUTPUT) или выбран другой формат сохранения.
+    :param base_path: путь без расширения
+    :param options: настройки кодировщика (см. encoder.encode_options)
+    :param timing: RequestTiming, куда записываются фазы decode, encode и write
+    :param encoder: EncodePool; если задан, перекодирование выполняется в нём
+    :param thumbnail: создать миниатюру (см. thumbnails.thumbnail_path); при перекодировании
+        она делается из уже декодированного изображения
+    :return: путь к сохранённому файлу или PendingEncode, если файл ещё кодируется в пуле
+    """
+    timing = timing or RequestTiming()
+    try:
+        if output_format == OUTPUT_PASSTHROUGH:
+            if image_format:
+                path = f"{base_path}.{image_format}"
+                os.replace(tmp_path, path)
+                timing.lap("write")
+                if thumbnail:
+                    return _finalize_thumbnail(path, timing, encoder, stop_event)
+                return path
+            output_format, options = FALLBACK_OUTPUT, None
+
+        path = f"{base_path}.{OUTPUT_FORMATS[output_format]['extension']}"
+        if encoder is not None:
+            future = encoder.submit(tmp_path, path, output_format, options, stop_event=stop_event,
+                                    thumbnail=thumbnail)
+            if future is None:
+                raise JobCancelledError()
+            return PendingEncode(future, tmp_path, path, timing, output_format)
+
+        _add_encode_phases(timing, encode_file(tmp_path, path, output_format, options, thumbnail))
+        remove_quietly(tmp_path)
+        return path
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+
+
+def _finalize_thumbnail(path, timing, encoder, stop_event):
+    """
+    Миниатюра файла, сохранённого как есть. Ошибка миниатюры не делает
+    задание неудачным: просмотрщик тогда уменьшит изображение сам.
+    """
+    if encoder is not None:
+        future = encoder.submit_thumbnail(path, stop_event=stop_event)
+        if future is None:
+            return path  # пакет остановлен, файл уже сохранён
+        return PendingEncode(future, None, path, timing, OUTPUT_PASSTHROUGH, required=False)
+    try:
+        _add_encode_phases(timing, make_thumbnail(path))
+    except Exception as e:
+        logger.warning("Не удалось создать миниатюру %s: %s", path, e, extra={'path': path})
+    return path
+
+
+class PendingEncode:
+    """
+    Задание, скачанное и переданное в пул кодирования. Поток загрузки уже
+    свободен; результат забирается методом result() по завершении future.
+    :param required: False — в пуле только миниатюра, и её ошибка не отменяет сохранённый файл
+    """
+
+    def __init__(self, future, tmp_path, path, timing, output_format, required=True):
+        self.future = future
+        self.tmp_path = tmp_path
+        self.path = path
+        self.timing = timing
+        self.output_format = output_format
+        self.required = required
+
+    def result(self):
+        """:return: путь к сохранённому файлу"""
+        try:
+            phases = self.future.result()
+        except Exception as e:
+            if self.required:
+                raise
+            logger.warning("Не удалось создать миниатюру %s: %s", self.path, e, extra={'path': self.path})
+            return self.path
+        finally:
+            if self.tmp_path:
+                remove_quietly(self.tmp_path)
+        _add_encode_phases(self.timing, phases)
+        return self.path
+
+
+class UnexpectedContentError(Exception):
+    """Сервер вернул ответ, который не является изображением."""
+
+    def __init__(self, content_type, body_preview):
+        super().__init__(f"Неверный Content-Type: {content_type}")
+        self.content_type = content_type
+        self.body_preview = body_preview
+
+
+class JobCancelledError(Exception):
+    """Задание не выполнено, потому что генерация была остановлена."""
+
+
+class JobBuffer:
+    """
+    Ограниченный запас заданий по моделям, пополняемый из ленивого итератора.
+    Новые задания сохраняются в очередь заданий пачкой при выборке, поэтому
+    ни в памяти, ни в базе не бывает больше заданий, чем нужно для загрузки пула.
+    """
+
+    def __init__(self, jobs, lookahead, job_queue=None, batch_id=None):
+        self._jobs = iter(jobs)
+        self._exhausted = False
+        self.lookahead = lookahead
+        self.job_queue = job_queue
+        self.batch_id = batch_id
+        self.queues = {}
+        self._size = 0
+
+    def __bool__(self):
+        return self._size > 0 or not self._exhausted
+
+    def refill(self):
+        """Пополняет запас, когда в нём осталось не больше половины."""
+        if self._exhausted or self._size > self.lookahead // 2:
+            return
+        fresh = []
+        while self._size < self.lookahead:
+            job = next(self._jobs, None)
+            if job is None:
+                self._exhausted = True
+                break
+            if job['id'] is None:
+                fresh.append(job)
+            self.queues.setdefault(job['model'], deque()).append(job)
+            self._size += 1
+        if fresh and self.job_queue is not None:
+            self.job_queue.add_jobs(self.batch_id, fresh, fresh[-1]['seq'] + 1)
+
+    def pop(self, model):
+        self._size -= 1
+        return self.queues[model].popleft()
+
+    def appendleft(self, job):
+        """Возвращает задание в начало очереди его модели."""
+        self.queues.setdefault(job['model'], deque()).appendleft(job)
+        self._size += 1
+
+    def append(self, job):
+        """Ставит задание в конец очереди его модели, после уже выбранных."""
+        self.queues.setdefault(job['model'], deque()).append(job)
+        self._size += 1
+
+
+class GenerationEngine:
+    """
+    Генерация пакета изображений без зависимости от Qt. Пакет описывается
+    сеткой параметров (SweepSpec); без неё — одним промптом и размером.
+    Пакеты выполняет BatchScheduler; run() выполняет один пакет.
+    О ходе работы сообщает через необязательные обратные вызовы:
+    on_progress(percent), on_image(path), on_error(message),
+    on_bytes(received, expected), on_timing(model, phases) и
+    on_finished(success, fails, summary).
+    С черновиками (draft) каждое большое изображение сначала запрашивается
+    в размере draft_size и передаётся в on_draft(path, job) — job содержит
+    prompt, model, seed и итоговые width и height. При DRAFT_AUTO следом
+    запрашивается итоговое изображение, при DRAFT_KEEP пакет ограничивается
+    черновиками, а итоговые запрашиваются отдельным пакетом (JobList) для
+    выбранных. Для итогового изображения по черновику перед on_image
+    вызывается on_final(draft_path, path).
+    on_result(path, record) получает вместе с путём параметры задания
+    (prompt, model, seed, width, height), latency и timings — ту же запись,
+    что попадает в каталог.
+    Обратные вызовы, кроме on_bytes, выполняются в потоке планировщика.
+    """
+
+    def __init__(self, prompt, final_width, final_height, models, save_dir, count,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, per_model_limit=DEFAULT_PER_MODEL_LIMIT,
+                 output_format=OUTPUT_PASSTHROUGH, output_options=None, thumbnails=False,
+                 max_retries=DEFAULT_MAX_RETRIES, seed=None, use_cache=True, use_catalog=True, draft=None,
+                 job_queue=None, batch_id=None, sweep=None, scheduling=SCHEDULING_ROUND_ROBIN,
+                 on_progress=None, on_image=None, on_error=None, on_bytes=None, on_timing=None,
+                 on_finished=None, on_draft=None, on_final=None, on_result=None):
+        self.sweep = sweep or SweepSpec([prompt], models, [(final_width, final_height)],
+                                        seed_count=count, seed_start=seed)
+        self.prompt = prompt
+        self.final_width = final_width
+        self.final_height = final_height
+        self.models = models
+        self.save_dir = save_dir
+        self.count = count
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_model_limit = max(1, per_model_limit)
+        self.output_format = output_format
+        self.output_options = output_options
+        self.thumbnails = thumbnails
+        self.draft = draft
+        self.max_retries = max_retries
+        self.retry_policy = RetryPolicy(max_retries=max_retries)
+        self.seed = seed
+        self.use_cache = use_cache
+        self.cache = get_result_cache() if use_cache else None
+        self.use_catalog = use_catalog
+        self.catalog = get_catalog() if use_catalog else None
+        self.job_queue = job_queue
+        self.batch_id = batch_id
+        self.scheduling = scheduling
+        self._is_running = True
+        self._resumable = False
+        self._stop_event = threading.Event()
+        self._requests = RequestCanceller()
+        self._bytes_lock = threading.Lock()
+        self._bytes_received = 0
+        self._bytes_expected = 0
+        self._bytes_emitted_at = 0.0
+        self._buffer = None
+        self._in_flight = {}
+        self._in_flight_total = 0
+        self._last_served = {}
+        self._served_count = 0
+        self._done = 0
+        self._total = 0
+        self._fails = []
+        self._interrupted = []  # задания, прерванные остановкой пакета
+        self.timing_summary = TimingSummary()
+        self.output_summary = OutputSummary()
+        self._critical = None
+        self._started_empty = False
+        self._cache_before = None
+        self._queued = 0  # задания пакета, учтённые в metrics.queue_depth
+        self.encoder = get_encode_pool()
+        self.scheduler = None
+        self.result = None
+        self.on_progress = on_progress
+        self.on_image = on_image
+        self.on_error = on_error
+        self.on_bytes = on_bytes
+        self.on_timing = on_timing
+        self.on_finished = on_finished
+        self.on_draft = on_draft
+        self.on_final = on_final
+        self.on_result = on_result
+
+    @classmethod
+    def from_batch(cls, job_queue, batch_id, **callbacks):
+        """Создаёт генератор, продолжающий незавершённый пакет из очереди заданий."""
+        batch = job_queue.get_batch(batch_id)
+        options = batch['options']
+        sweep = spec_from_dict(options['sweep']) if 'sweep' in options else None
+        return cls(batch['prompt'], batch['width'], batch['height'], options['models'], batch['save_dir'],
+                   options['count'],
+                   max_concurrency=options.get('max_concurrency', DEFAULT_MAX_CONCURRENCY),
+                   per_model_limit=options.get('per_model_limit', DEFAULT_PER_MODEL_LIMIT),
+                   output_format=options.get('output_format') or (
+                       OUTPUT_PASSTHROUGH if options.get('passthrough', True) else OUTPUT_JPEG),
+                   output_options=options.get('output_options'),
+                   thumbnails=options.get('thumbnails', False),
+                   max_retries=options.get('max_retries', DEFAULT_MAX_RETRIES),
+                   seed=options.get('seed'),
+                   use_cache=options.get('use_cache', True),
+                   use_catalog=options.get('use_catalog', True),
+                   draft=options.get('draft'),
+                   scheduling=options.get('scheduling', SCHEDULING_ROUND_ROBIN),
+                   job_queue=job_queue, batch_id=batch_id, sweep=sweep, **callbacks)
+
+    def batch_options(self):
+        """Настройки пакета, которые сохраняются в очереди заданий для продолжения после сбоя."""
+        return {
+            'models': self.models,
+            'count': self.count,
+            'max_concurrency': self.max_concurrency,
+            'per_model_limit': self.per_model_limit,
+            'output_format': self.output_format,
+            'output_options': self.output_options,
+            'thumbnails': self.thumbnails,
+            'max_retries': self.max_retries,
+            'seed': self.seed,
+            'use_cache': self.use_cache,
+            'use_catalog': self.use_catalog,
+            'draft': self.draft,
+            'scheduling': self.scheduling,
+            'sweep': self.sweep.to_dict(),
+        }
+
+    def prepare_jobs(self):
+        """
+        Возвращает ленивый итератор заданий. Seed вычисляется сеткой
+        детерминированно, поэтому продолжение пакета после сбоя запрашивает
+        те же изображения: сначала незавершённые задания из очереди, затем
+        ещё не выбранная часть сетки.
+        :return: (итератор заданий, уже выполнено, всего заданий в пакете)
+        """
+        if self.batch_id is not None:
+            self.job_queue.reset_running(self.batch_id)
+            batch = self.job_queue.get_batch(self.batch_id)
+            counts = self.job_queue.counts(self.batch_id)
+            total = batch['total'] if batch['total'] is not None else len(self.sweep)
+            jobs = itertools.chain(self.job_queue.load_jobs(self.batch_id),
+                                   self.sweep.iter_jobs(start=batch['cursor']))
+            return jobs, counts[DONE], total
+
+        total = len(self.sweep)
+        if self.job_queue is not None and total:
+            width, height = self.sweep.sizes[0]
+            self.batch_id = self.job_queue.create_batch(self.sweep.prompts[0], width, height,
+                                                        self.save_dir, total, self.batch_options())
+        return self.sweep.iter_jobs(), 0, total
+
+    @staticmethod
+    def _as_draft(job):
+        # У продолжаемого пакета черновик задания может быть уже сохранён
+        if not job.get('draft_path') and max(job['width'], job['height']) > DRAFT_MAX_SIDE:
+            job['draft'] = True
+        return job
+
+    def _update_job(self, method, job, *args):
+        if self.job_queue is not None and job['id'] is not None:
+            getattr(self.job_queue, method)(job['id'], *args)
+
+    def _notify(self, callback, *args):
+        if callback is not None:
+            callback(*args)
+
+    def start(self):
+        """
+        Готовит пакет к выполнению: создаёт папку, формирует задания и
+        сообщает о уже выполненной части. Вызывается планировщиком.
+        """
+        metrics.active_batches.inc()
+        os.makedirs(self.save_dir, exist_ok=True)
+        jobs, self._done, self._total = self.prepare_jobs()
+        if self.draft:
+            os.makedirs(os.path.join(self.save_dir, DRAFT_DIR), exist_ok=True)
+            jobs = map(self._as_draft, jobs)
+        self._buffer = JobBuffer(jobs, max(MIN_LOOKAHEAD, self.max_concurrency * 8), self.job_queue, self.batch_id)
+        self._buffer.refill()
+        self._started_empty = not self._buffer
+        self._cache_before = self.cache.stats() if self.cache is not None else None
+        self._queued = max(0, self._total - self._done) if self._buffer else 0
+        metrics.queue_depth.inc(amount=self._queued)
+        if self._done and self._total:
+            self._notify(self.on_progress, int(self._done / self._total * 100))
+
+    def has_jobs(self):
+        """Есть ли задания, которые ещё можно запустить."""
+        return self._is_running and self._buffer is not None and bool(self._buffer)
+
+    def take_job(self, allow_model):
+        """
+        Выбирает следующее задание с учётом ограничений пакета и общих
+        ограничений планировщика (allow_model(model)) и помечает его выполняемым.
+        Модель выбирается согласно политике self.scheduling.
+        :return: задание или None
+        """
+        if not self.has_jobs() or self._in_flight_total >= self.max_concurrency:
+            return None
+        self._buffer.refill()
+        models = [model for model, queue in self._buffer.queues.items() if queue]
+        for model in order_models(models, self._last_served, self.scheduling):
+            if self._in_flight.get(model, 0) < self.per_model_limit and allow_model(model):
+                job = self._buffer.pop(model)
+                self._served_count += 1
+                self._last_served[model] = self._served_count
+                self._in_flight[model] = self._in_flight.get(model, 0) + 1
+                self._in_flight_total += 1
+                job['timing'] = RequestTiming()
+                self._update_job('mark_running', job)
+                metrics.in_flight.inc()
+                return job
+        return None
+
+    def job_finished(self, job, future):
+        """
+        Обрабатывает результат задания. Вызывается планировщиком в его потоке:
+        сначала по завершении загрузки, а для перекодируемых изображений ещё
+        раз — по завершении кодирования в пуле процессов.
+        """
+        model, i = job['model'], job['index']
+        encoding = job.pop('encoding', None)
+        if encoding is None:
+            self._in_flight[model] -= 1
+            self._in_flight_total -= 1
+            metrics.in_flight.dec()
+        try:
+            path = encoding.result() if encoding is not None else future.result()
+            if isinstance(path, PendingEncode):
+                # Слот загрузки свободен, задание завершится вместе с кодированием
+                job['encoding'] = path
+                self.scheduler.defer(self, job, path.future)
+                return
+        except JobCancelledError:
+            self._update_job('mark_pending', job)
+            self._interrupted.append({key: job[key] for key in
+                                      ('prompt', 'model', 'seed', 'width', 'height', 'index')})
+            return
+        except ThrottledError as e:
+            # Ограничение частоты — не ошибка задания: возвращаем его в начало очереди
+            job['requeues'] = job.get('requeues', 0) + 1
+            if job['requeues'] <= MAX_THROTTLE_REQUEUES:
+                logger.info("Модель '%s' (попытка %s): %s, задание возвращено в очередь", model, i, e,
+                            extra={'batch_id': self.batch_id, 'model': model, 'attempt': i})
+                self._update_job('mark_pending', job)
+                self._buffer.appendleft(job)
+            else:
+                self._update_job('mark_failed', job, self._record_failure(self._fails, model, i, e))
+                self._job_completed(model, "failed")
+            return
+        except Exception as e:
+            self._update_job('mark_failed', job, self._record_failure(self._fails, model, i, e))
+            self._job_completed(model, "failed")
+            return
+
+        if job.get('draft'):
+            self._draft_finished(job, path)
+            return
+        self._update_job('mark_done', job, path)
+        self._job_completed(model, "done")
+        self._record_output(path, encoding.output_format if encoding is not None else OUTPUT_PASSTHROUGH,
+                            job['timing'].phases['encode'])
+        record = {
+            'path': path, 'batch_id': self.batch_id, 'prompt': job['prompt'], 'model': model,
+            'seed': job['seed'], 'width': job['width'], 'height': job['height'],
+            'latency': round(job['timing'].total(), 4), 'timings': job['timing'].to_dict(),
+        }
+        if self.catalog is not None:
+            self.catalog.add(record)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Модель '%s' (попытка %s): сохранено %s", model, i, path,
+                         extra={'batch_id': self.batch_id, 'model': model, 'attempt': i,
+                                'latency': round(job['timing'].total(), 3), 'path': path})
+        self.timing_summary.add(model, job['timing'])
+        for phase, seconds in job['timing'].phases.items():
+            metrics.phase_duration.observe(model, phase, value=seconds)
+        self._notify(self.on_timing, model, job['timing'].to_dict())
+        if job.get('draft_path'):
+            self._notify(self.on_final, job['draft_path'], path)
+        self._notify(self.on_result, path, record)
+        self._notify(self.on_image, path)
+        self._done += 1
+        self._notify(self.on_progress, int(self._done / self._total * 100))
+
+    def _draft_finished(self, job, path):
+        """
+        Черновик сохранён. При DRAFT_AUTO задание возвращается в конец очереди
+        своей модели уже за итоговым изображением; при DRAFT_KEEP черновик —
+        результат задания.
+        """
+        model = job['model']
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Модель '%s' (попытка %s): сохранён черновик %s", model, job['index'], path,
+                         extra={'batch_id': self.batch_id, 'model': model, 'attempt': job['index'],
+                                'latency': round(job['timing'].total(), 3), 'path': path})
+        self._notify(self.on_draft, path, {key: job[key] for key in
+                                           ('prompt', 'model', 'seed', 'width', 'height', 'index')})
+        if self.draft == DRAFT_AUTO:
+            metrics.images_total.inc(model, "draft")
+            self._update_job('mark_draft_saved', job, path)
+            final = {key: value for key, value in job.items() if key not in ('draft', 'timing', 'requeues')}
+            final['draft_path'] = path
+            self._buffer.append(final)
+            return
+        self._update_job('mark_done', job, path)
+        self._job_completed(model, "done")
+        self._done += 1
+        self._notify(self.on_progress, int(self._done / self._total * 100))
+
+    def _record_output(self, path, output_format, encode_seconds):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        self.output_summary.add(output_format, encode_seconds, size)
+        metrics.output_bytes.inc(output_format, amount=size)
+        if output_format != OUTPUT_PASSTHROUGH:
+            metrics.encode_duration.observe(output_format, value=encode_seconds)
+
+    def _job_completed(self, model, result):
+        metrics.images_total.inc(model, result)
+        if self._queued:
+            self._queued -= 1
+            metrics.queue_depth.dec()
+
+    def abort(self, exc):
+        """Останавливает пакет после критической ошибки."""
+        error_message = f"Критическая ошибка в потоке генерации: {exc}"
+        logger.error(error_message, exc_info=exc, extra={'batch_id': self.batch_id})
+        self._notify(self.on_error, error_message)
+        self._critical = [{'model': 'N/A', 'count': 0, 'error': str(exc)}]
+        self.stop()
+
+    def finish(self):
+        """
+        Завершает пакет, когда в нём не осталось выполняемых заданий.
+        :return: (успех, список ошибок в формате {'model', 'count', 'error'})
+        """
+        if self._critical:
+            self.result = (False, self._critical)
+        elif self._total == 0 or self._started_empty:
+            # Пакет без заданий или уже выполненный целиком
+            if self.batch_id is not None:
+                self.job_queue.finish_batch(self.batch_id, BATCH_DONE)
+            self.result = (self._total == 0 or self._done > 0, [])
+        else:
+            if self.batch_id is not None and not self._resumable:
+                self.job_queue.finish_batch(self.batch_id, BATCH_DONE if self._is_running else BATCH_CANCELLED)
+            self._emit_bytes_progress()
+            logger.info("Статистика пула соединений: %s", get_pool_stats(), extra={'batch_id': self.batch_id})
+            if self.cache is not None:
+                cache_after = self.cache.stats()
+                logger.info("Кэш результатов: попаданий %d, промахов %d, записей %d (%.1f МБ)",
+                            cache_after['hits'] - self._cache_before['hits'],
+                            cache_after['misses'] - self._cache_before['misses'],
+                            cache_after['entries'], cache_after['bytes'] / (1024 * 1024),
+                            extra={'batch_id': self.batch_id})
+            self.result = (self._done > 0 and self._is_running, self._fails)
+        if self.catalog is not None and not self.catalog.flush():
+            logger.warning("Каталог изображений не успел сохранить результаты пакета",
+                           extra={'batch_id': self.batch_id})
+        metrics.queue_depth.dec(amount=self._queued)
+        metrics.active_batches.dec()
+        self._queued = 0
+        self._notify(self.on_finished, *self.result, self.summary())
+        return self.result
+
+    def summary(self):
+        """
+        Сводка пакета, передаваемая в on_finished: средние и максимальные
+        длительности фаз по моделям, время кодирования и объём файлов по форматам
+        и итог заданий (см. jobs_summary).
+        """
+        return {'timing': self.timing_summary.to_dict(), 'output': self.output_summary.to_dict(),
+                'jobs': self.jobs_summary()}
+
+    def jobs_summary(self):
+        """
+        Итог заданий: всего, выполнено, с ошибкой, отменено остановкой (не начатые
+        и прерванные) и сами прерванные задания — их можно запросить снова.
+        """
+        failed = len(self._fails)
+        cancelled = 0 if self._is_running else max(0, self._total - self._done - failed)
+        return {'total': self._total, 'done': self._done, 'failed': failed, 'cancelled': cancelled,
+                'interrupted': list(self._interrupted)}
+
+    def run(self):
+        """
+        Выполняет пакет в вызывающем потоке с собственным планировщиком.
+        :return: (успех, список ошибок в формате {'model', 'count', 'error'})
+        """
+        scheduler = BatchScheduler(self.max_concurrency, self.per_model_limit)
+        scheduler.submit(self)
+        scheduler.run_until_idle()
+        return self.result
+
+    def generate_image(self, job):
+        """
+        Выполняет запрос генерации и сохраняет результат. Если такой же запрос
+        уже есть в кэше, файл берётся оттуда без обращения к сети; если он
+        сейчас выполняется другим заданием (в том числе из другого пакета),
+        задание ждёт его результата вместо повторного запроса.
+        :return: путь к файлу
+        """
+        model, i = job['model'], job['index']
+        timing = job.setdefault('timing', RequestTiming())
+        timing.lap("queue")
+        width, height = draft_size(job['width'], job['height']) if job.get('draft') else (job['width'], job['height'])
+        params = {
+            "model": model,
+            "seed": job['seed'],
+            "width": width,
+            "height": height,
+            "nologo": "true"
+        }
+        prompt = job['prompt']
+        key = cache_key(prompt, params)
+
+        if self.cache is not None:
+            cached_path = self.cache.lookup(key)
+            metrics.cache_lookups.inc("hit" if cached_path else "miss")
+            if cached_path:
+                try:
+                    tmp_path = copy_to_temp(cached_path, self.save_dir)
+                except OSError:
+                    tmp_path = None  # запись вытеснена из кэша между поиском и копированием
+                if tmp_path:
+                    timing.lap("write")
+                    image_format = os.path.splitext(cached_path)[1].lstrip(".")
+                    return self._finalize(tmp_path, model, i, image_format, timing, job.get('draft'))
+
+        while True:
+            flight, leader = inflight_requests.join(key)
+            if leader:
+                try:
+                    tmp_path, image_format = self.request_with_retries(prompt, model, i, params, timing)
+                except BaseException as e:
+                    inflight_requests.complete(key, flight, error=e)
+                    raise
+                shared = self._share_result(key, tmp_path, image_format)
+                timing.lap("write")
+                inflight_requests.complete(key, flight, result=shared)
+                if shared[0] != tmp_path:
+                    # Остальные участники возьмут файл из кэша, свой временный файл используем сами
+                    return self._finalize(tmp_path, model, i, image_format, timing, job.get('draft'))
+                break
+
+            logger.debug("Модель '%s' (попытка %s): такой же запрос уже выполняется, ожидаем его результата",
+                         model, i)
+            try:
+                shared = flight.wait(self._stop_event)
+            except JobCancelledError:
+                # Ведущее задание остановлено вместе со своим пакетом — выполняем запрос сами
+                flight.release()
+                if not self._is_running:
+                    raise
+                continue
+            except BaseException:
+                flight.release()
+                raise
+            if shared is None:
+                flight.release()
+                raise JobCancelledError()
+            break
+
+        timing.lap("queue")
+        shared_path, image_format, is_temp = shared
+        try:
+            tmp_path = copy_to_temp(shared_path, self.save_dir)
+        finally:
+            if flight.release() and is_temp:
+                remove_quietly(shared_path)
+        timing.lap("write")
+        return self._finalize(tmp_path, model, i, image_format, timing, job.get('draft'))
+
+    def _finalize(self, tmp_path, model, i, image_format, timing, draft=False):
+        if draft:
+            # Черновики сохраняются как есть, без миниатюр: они и так небольшие
+            return finalize_image(tmp_path, self._output_base_path(model, i, draft=True), image_format,
+                                  timing=timing, encoder=self.encoder, stop_event=self._stop_event)
+        return finalize_image(tmp_path, self._output_base_path(model, i), image_format, self.output_format,
+                              self.output_options, timing, encoder=self.encoder, stop_event=self._stop_event,
+                              thumbnail=self.thumbnails)
+
+    def _share_result(self, key, tmp_path, image_format):
+        """
+        Делает скачанный файл доступным для ожидающих участников: через кэш,
+        а если он выключен или недоступен — через сам временный файл.
+        :return: (путь, формат, временный ли это файл)
+        """
+        if self.cache is not None and image_format:
+            try:
+                return self.cache.store(key, tmp_path, image_format), image_format, False
+            except OSError as e:
+                logger.warning("Не удалось сохранить результат в кэш: %s", e)
+        return tmp_path, image_format, True
+
+    def request_with_retries(self, prompt, model, i, params, timing=None):
+        """
+        Выполняет запрос с повторами. Повторы используют тот же seed; запросы к
+        модели с разомкнутым предохранителем сразу завершаются CircuitOpenError.
+        :return: (путь к временному файлу с ответом, формат)
+        """
+        timing = timing or RequestTiming()
+        limiter_key = (urlparse(get_api_base_url()).netloc, model)
+        attempt = 1
+        while True:
+            if not rate_limiter.acquire(limiter_key, self._stop_event):
+                raise JobCancelledError()
+            # После ожидания очереди: пробный запрос предохранителя выполняется сразу
+            if not circuit_breaker.allow(model):
+                raise CircuitOpenError(model)
+            timing.lap("queue")
+            started = time.monotonic()
+            try:
+                result = self.fetch_image(prompt, model, i, params, timing)
+            except ThrottledError as e:
+                rate_limiter.on_throttled(limiter_key, e.retry_after)
+                # Сервер ответил, значит модель доступна: пробный запрос предохранителя считается успешным
+                circuit_breaker.record_success(model)
+                raise
+            except Exception as e:
+                if self._requests.cancelled:
+                    # Соединение закрыто остановкой пакета — это не отказ модели
+                    circuit_breaker.release(model)
+                    raise JobCancelledError() from e
+                if is_retryable(e) or isinstance(e, UnexpectedContentError):
+                    circuit_breaker.record_failure(model)
+                elif isinstance(e, requests.exceptions.HTTPError):
+                    # Ответ 4xx: сервер ответил, ошибка в самом запросе, а не в модели
+                    circuit_breaker.record_success(model)
+                else:
+                    circuit_breaker.release(model)
+                if not self._is_running or not self.retry_policy.should_retry(attempt, e):
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                metrics.retries_total.inc(model)
+                logger.warning("Модель '%s' (попытка %s): повтор %d через %.1f с после ошибки: %s",
+                               model, i, attempt, delay, e,
+                               extra={'batch_id': self.batch_id, 'model': model, 'attempt': i})
+                if self._stop_event.wait(delay):
+                    raise
+                timing.lap("queue")
+                attempt += 1
+                continue
+
+            circuit_breaker.record_success(model)
+            rate_limiter.on_success(limiter_key)
+            elapsed = time.monotonic() - started
+            model_latency.record(model, elapsed)
+            metrics.request_duration.observe(model, value=elapsed)
+            return result
+
+    def fetch_image(self, prompt, model, i, params, timing=None):
+        """
+        Выполняет один HTTP-запрос генерации и потоково скачивает ответ.
+        stop() прерывает запрос на любом этапе, закрывая его соединение.
+        :return: (путь к временному файлу в папке сохранения, формат по сигнатуре)
+        """
+        timing = timing or RequestTiming()
+        encoded_prompt = requests.utils.quote(prompt)
+        url = f"{get_api_base_url()}/prompt/{encoded_prompt}"
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Запрос: %s с параметрами %s", url, params,
+                         extra={'batch_id': self.batch_id, 'model': model, 'attempt': i})
+
+        take_connect_time()
+        with cancellable(self._requests):
+            try:
+                response = get_session().get(url, params=params, timeout=60, stream=True)
+            except requests.exceptions.Timeout:
+                metrics.requests_total.inc(model, "timeout")
+                raise
+            except requests.exceptions.RequestException:
+                metrics.requests_total.inc(model, "cancelled" if self._requests.cancelled else "error")
+                raise
+            return self._read_response(response, model, timing)
+
+    def _read_response(self, response, model, timing):
+        with response as r:
+            metrics.requests_total.inc(model, r.status_code)
+            connect_time = take_connect_time()
+            timing.add("connect", connect_time)
+            timing.lap("ttfb", exclude=connect_time)
+            if r.status_code >= 400:
+                # Тело ответа с ошибкой небольшое: дочитываем его, чтобы соединение вернулось в пул
+                _ = r.content
+            retry_after = parse_retry_after(r.headers.get('retry-after'))
+            # 503 без Retry-After — скорее отказ модели, его обрабатывают повторы и предохранитель
+            if r.status_code == 429 or (r.status_code in THROTTLE_STATUSES and retry_after is not None):
+                raise ThrottledError(r.status_code, retry_after)
+            r.raise_for_status()
+
+            content_type = r.headers.get('content-type')
+            if not content_type or 'image' not in content_type:
+                preview = next(r.iter_content(200), b"").decode(r.encoding or "utf-8", errors="replace")
+                raise UnexpectedContentError(content_type, preview)
+
+            self._add_expected_bytes(int(r.headers.get('content-length') or 0))
+
+            def on_chunk(size):
+                self._add_received_bytes(size)
+                metrics.downloaded_bytes.inc(model, amount=size)
+
+            tmp_path, image_format = download_to_temp(r.iter_content(CHUNK_SIZE), self.save_dir,
+                                                      on_chunk=on_chunk, timing=timing)
+        if self._requests.cancelled:
+            # Ответ без Content-Length при закрытом соединении обрывается без ошибки
+            remove_quietly(tmp_path)
+            raise JobCancelledError()
+        return tmp_path, image_format
+
+    def _output_base_path(self, model, i, draft=False):
+        safe_model_name = "".join(c if c.isalnum() else "_" for c in model)
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        if draft:
+            return os.path.join(self.save_dir, DRAFT_DIR, f"draft_{safe_model_name}_{timestamp}_{i}")
+        filename = f"generated_{safe_model_name}_{timestamp}_{i}"
+        return os.path.join(self.save_dir, filename)
+
+    def _add_expected_bytes(self, size):
+        with self._bytes_lock:
+            self._bytes_expected += size
+
+    def _add_received_bytes(self, size):
+        """Вызывается из потоков пула; сигнал отправляется не чаще BYTES_PROGRESS_INTERVAL."""
+        now = time.monotonic()
+        with self._bytes_lock:
+            self._bytes_received += size
+            if now - self._bytes_emitted_at < BYTES_PROGRESS_INTERVAL:
+                return
+            self._bytes_emitted_at = now
+            received, expected = self._bytes_received, self._bytes_expected
+        self._notify(self.on_bytes, received, expected)
+
+    def _emit_bytes_progress(self):
+        with self._bytes_lock:
+            received, expected = self._bytes_received, self._bytes_expected
+        self._notify(self.on_bytes, received, expected)
+
+    def _record_failure(self, fails, model, i, exc):
+        if isinstance(exc, ThrottledError):
+            error_message = f"Модель '{model}' (попытка {i}): сервер продолжает ограничивать частоту запросов (HTTP {exc.status_code})."
+            error = str(exc)
+        elif isinstance(exc, CircuitOpenError):
+            error_message = f"Модель '{model}' (попытка {i}): пропущено, модель временно отключена после серии ошибок."
+            error = "Circuit open"
+        elif isinstance(exc, UnexpectedContentError):
+            error_message = f"Модель '{model}' (попытка {i}) вернула не изображение (Content-Type: {exc.content_type}). Ответ:\n{exc.body_preview}..."
+            error = str(exc)
+        elif isinstance(exc, requests.exceptions.Timeout):
+            error_message = f"Модель '{model}' (попытка {i}): Время ожидания запроса истекло."
+            error = "Timeout"
+        elif isinstance(exc, requests.exceptions.RequestException):
+            error_message = f"Модель '{model}' (попытка {i}): Ошибка сети/HTTP: {exc}"
+            error = str(exc)
+        else:
+            error_message = f"Модель '{model}' (попытка {i}): Неожиданная ошибка: {exc}"
+            error = str(exc)
+
+        logger.error(error_message, extra={'batch_id': self.batch_id, 'model': model, 'attempt': i})
+        self._notify(self.on_error, error_message)
+        fails.append({
+            'model': model,
+            'count': i,
+            'error': error
+        })
+        return error
+
+    def stop(self, resumable=False):
+        """
+        Запрашивает остановку: новые задания не запускаются, ожидания прерываются,
+        а выполняемые запросы обрываются вместе с их соединениями.
+        :param resumable: не отменять пакет в очереди заданий — он будет предложен
+            к продолжению при следующем запуске (остановка при выходе из приложения)
+        """
+        logger.info("Запрос на остановку генерации", extra={'batch_id': self.batch_id})
+        self._resumable = resumable
+        self._is_running = False
+        self._stop_event.set()
+        self._requests.cancel()
+        if self.scheduler is not None:
+            self.scheduler.wake()
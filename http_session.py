@@ -0,0 +1,291 @@
+import contextlib
+import os
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+DEFAULT_API_BASE_URL = "https://image.pollinations.ai"
+API_URL_ENV = "ARTIFICIALMUSE_API_URL"  # позволяет направить запросы на локальную заглушку (stub_server.py)
+
+POOL_CONNECTIONS = 4      # сколько разных хостов держим в пуле
+POOL_MAXSIZE = 32         # соединений на один хост (не меньше максимального параллелизма)
+DNS_TTL = 300             # секунд
+WARM_UP_INTERVAL = 30     # не прогреваем чаще, чем раз в N секунд
+
+
+class DnsCache:
+    """Потокобезопасный кэш разрешения имён с ограниченным временем жизни записей."""
+
+    def __init__(self, ttl=DNS_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                pool_stats.record_dns(hit=True)
+                return entry[0]
+
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        address = infos[0][4][0]
+        with self._lock:
+            self._entries[key] = (address, now + self.ttl)
+        pool_stats.record_dns(hit=False)
+        return address
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class PoolStats:
+    """Счётчики использования пула соединений."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.new_connections = 0
+            self.connect_time = 0.0
+            self.dns_hits = 0
+            self.dns_misses = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connection(self, elapsed):
+        with self._lock:
+            self.new_connections += 1
+            self.connect_time += elapsed
+
+    def record_dns(self, hit):
+        with self._lock:
+            if hit:
+                self.dns_hits += 1
+            else:
+                self.dns_misses += 1
+
+    def snapshot(self):
+        """Возвращает копию счётчиков. hits — запросы, обслуженные уже открытым соединением."""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hits': max(0, self.requests - self.new_connections),
+                'new_connections': self.new_connections,
+                'connect_time': round(self.connect_time, 4),
+                'dns_hits': self.dns_hits,
+                'dns_misses': self.dns_misses,
+            }
+
+
+pool_stats = PoolStats()
+dns_cache = DnsCache()
+
+
+_connect_time = threading.local()
+
+
+def take_connect_time():
+    """Возвращает время установки соединений в текущем потоке с предыдущего вызова и обнуляет его."""
+    elapsed = getattr(_connect_time, 'elapsed', 0.0)
+    _connect_time.elapsed = 0.0
+    return elapsed
+
+
+class RequestCanceller:
+    """
+    Сокеты запросов, выполняемых внутри cancellable(canceller). cancel()
+    закрывает их на чтение и запись: потоки, ждущие ответа или очередного
+    блока тела, сразу получают ошибку соединения, не дожидаясь тайм-аута.
+    Запросы, начатые после cancel(), прерываются при установке соединения.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sockets = set()
+        self.cancelled = False
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            sockets = list(self._sockets)
+        for sock in sockets:
+            _shutdown_socket(sock)
+
+    def _register(self, sock):
+        with self._lock:
+            if not self.cancelled:
+                self._sockets.add(sock)
+                return
+        _shutdown_socket(sock)
+
+    def _unregister(self, sock):
+        with self._lock:
+            self._sockets.discard(sock)
+
+
+def _shutdown_socket(sock):
+    try:
+        # Метод базового класса: SSLSocket.shutdown ещё и сбрасывает состояние TLS,
+        # которое в этот момент может читать другой поток
+        socket.socket.shutdown(sock, socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+_active_requests = threading.local()
+
+
+@contextlib.contextmanager
+def cancellable(canceller):
+    """Запросы текущего потока внутри блока прерываются вызовом canceller.cancel()."""
+    previous = getattr(_active_requests, 'scope', None)
+    scope = _active_requests.scope = (canceller, [])
+    try:
+        yield canceller
+    finally:
+        _active_requests.scope = previous
+        for sock in scope[1]:
+            canceller._unregister(sock)
+
+
+def _track_socket(sock):
+    scope = getattr(_active_requests, 'scope', None)
+    if scope is not None and sock is not None:
+        scope[1].append(sock)
+        scope[0]._register(sock)
+
+
+class _TrackedConnectionMixin:
+    """
+    Подставляет адрес из DNS-кэша, учитывает установку новых соединений
+    и передаёт сокеты запросов RequestCanceller текущего потока.
+    """
+
+    def _new_conn(self):
+        hostname = self._dns_host
+        try:
+            self._dns_host = dns_cache.resolve(hostname, self.port)
+        except OSError:
+            pass
+        try:
+            return super()._new_conn()
+        finally:
+            # Имя хоста нужно вернуть до TLS-рукопожатия: по нему проверяется сертификат (SNI).
+            self._dns_host = hostname
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        elapsed = time.perf_counter() - start
+        pool_stats.record_connection(elapsed)
+        _connect_time.elapsed = getattr(_connect_time, 'elapsed', 0.0) + elapsed
+        _track_socket(self.sock)
+
+    def request(self, *args, **kwargs):
+        # Соединение из пула уже открыто; новое откроется в connect() и будет учтено там
+        _track_socket(self.sock)
+        return super().request(*args, **kwargs)
+
+
+class TrackedHTTPConnection(_TrackedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TrackedHTTPSConnection(_TrackedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TrackedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TrackedHTTPConnection
+
+
+class TrackedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TrackedHTTPSConnection
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter с учётом статистики и кэшированием DNS."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TrackedHTTPConnectionPool,
+            "https": TrackedHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        pool_stats.record_request()
+        return super().send(request, **kwargs)
+
+
+_session = None
+_session_lock = threading.Lock()
+_last_warm_up = 0.0
+
+
+def get_session():
+    """Возвращает общую для процесса сессию с пулом keep-alive соединений."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = PooledAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def get_pool_stats():
+    return pool_stats.snapshot()
+
+
+_api_base_url = (os.environ.get(API_URL_ENV) or DEFAULT_API_BASE_URL).rstrip("/")
+
+
+def get_api_base_url():
+    """Адрес API генерации: DEFAULT_API_BASE_URL или значение переменной окружения API_URL_ENV."""
+    return _api_base_url
+
+
+def set_api_base_url(url):
+    global _api_base_url
+    _api_base_url = (url or DEFAULT_API_BASE_URL).rstrip("/")
+
+
+def warm_up(url=None, force=False):
+    """
+    Заранее открывает соединение с API в фоновом потоке, чтобы первый запрос
+    генерации не тратил время на DNS, TCP и TLS.
+    :return: True, если прогрев запущен
+    """
+    global _last_warm_up
+    now = time.monotonic()
+    with _session_lock:
+        if not force and now - _last_warm_up < WARM_UP_INTERVAL:
+            return False
+        _last_warm_up = now
+
+    def _warm():
+        try:
+            get_session().head(url or get_api_base_url(), timeout=10).close()
+        except requests.RequestException:
+            pass
+
+    threading.Thread(target=_warm, name="http-warm-up", daemon=True).start()
+    return True
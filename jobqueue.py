@@ -0,0 +1,200 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from app_paths import user_data_dir
+
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+BATCH_ACTIVE = "active"
+BATCH_DONE = "done"
+BATCH_CANCELLED = "cancelled"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    state TEXT NOT NULL DEFAULT 'active',
+    prompt TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    save_dir TEXT NOT NULL,
+    options TEXT NOT NULL DEFAULT '{}',
+    total INTEGER,
+    cursor INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id INTEGER NOT NULL REFERENCES batches(id) ON DELETE CASCADE,
+    seq INTEGER,
+    prompt TEXT,
+    width INTEGER,
+    height INTEGER,
+    model TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    seed INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    path TEXT,
+    draft_path TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_batch_state ON jobs(batch_id, state);
+CREATE INDEX IF NOT EXISTS batches_state ON batches(state);
+"""
+
+
+class JobQueue:
+    """
+    Очередь заданий генерации в SQLite. Каждое задание хранит модель, номер,
+    seed, состояние и число попыток, поэтому после падения приложения пакет
+    продолжается с того места, где остановился.
+    Задания пакета добавляются по мере выборки из сетки параметров: в базе
+    хранятся уже выбранные задания и курсор — число выбранных заданий сетки.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(user_data_dir(), "jobs.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            self._conn.execute(sql, params)
+
+    def create_batch(self, prompt, width, height, save_dir, total, options=None):
+        """
+        Создаёт пакет. Задания добавляются позже через add_jobs.
+        :param prompt, width, height: описание пакета для отображения (у сетки — первые значения)
+        :param total: общее число заданий пакета
+        :return: id пакета
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO batches (created_at, prompt, width, height, save_dir, options, total) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), prompt, width, height, save_dir, json.dumps(options or {}), total))
+        return cursor.lastrowid
+
+    def add_jobs(self, batch_id, jobs, cursor):
+        """
+        Добавляет выбранные из сетки задания и сдвигает курсор пакета в одной транзакции.
+        Присваивает заданиям id.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for job in jobs:
+                    job['id'] = self._conn.execute(
+                        "INSERT INTO jobs (batch_id, seq, prompt, width, height, model, idx, seed, draft_path) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (batch_id, job.get('seq'), job['prompt'], job['width'], job['height'],
+                         job['model'], job['index'], job['seed'], job.get('draft_path'))).lastrowid
+                self._conn.execute("UPDATE batches SET cursor = ? WHERE id = ?", (cursor, batch_id))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_batch(self, batch_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if row is None:
+            return None
+        batch = dict(row)
+        batch['options'] = json.loads(batch['options'])
+        return batch
+
+    def load_jobs(self, batch_id, states=(PENDING, RUNNING)):
+        """Возвращает задания пакета в заданных состояниях в порядке создания."""
+        placeholders = ", ".join("?" for _ in states)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, seq, prompt, width, height, model, idx, seed, attempts, draft_path FROM jobs "
+                f"WHERE batch_id = ? AND state IN ({placeholders}) ORDER BY id",
+                (batch_id, *states)).fetchall()
+        return [{'id': row['id'], 'seq': row['seq'], 'prompt': row['prompt'], 'width': row['width'],
+                 'height': row['height'], 'model': row['model'], 'index': row['idx'],
+                 'seed': row['seed'], 'attempts': row['attempts'], 'draft_path': row['draft_path']}
+                for row in rows]
+
+    def reset_running(self, batch_id):
+        """Задания, выполнявшиеся в момент падения, снова становятся ожидающими."""
+        self._write("UPDATE jobs SET state = ?, updated_at = ? WHERE batch_id = ? AND state = ?",
+                    (PENDING, time.time(), batch_id, RUNNING))
+
+    def mark_running(self, job_id):
+        self._write("UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (RUNNING, time.time(), job_id))
+
+    def mark_pending(self, job_id):
+        self._write("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?",
+                    (PENDING, time.time(), job_id))
+
+    def mark_draft_saved(self, job_id, draft_path):
+        """Черновик задания сохранён: задание снова ожидает — теперь за итоговым изображением."""
+        self._write("UPDATE jobs SET state = ?, draft_path = ?, updated_at = ? WHERE id = ?",
+                    (PENDING, draft_path, time.time(), job_id))
+
+    def mark_done(self, job_id, path):
+        self._write("UPDATE jobs SET state = ?, path = ?, error = NULL, updated_at = ? WHERE id = ?",
+                    (DONE, path, time.time(), job_id))
+
+    def mark_failed(self, job_id, error):
+        self._write("UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                    (FAILED, error, time.time(), job_id))
+
+    def counts(self, batch_id):
+        """Количество заданий пакета по состояниям."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) AS n FROM jobs WHERE batch_id = ? GROUP BY state",
+                (batch_id,)).fetchall()
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update({row['state']: row['n'] for row in rows})
+        return counts
+
+    def finish_batch(self, batch_id, state=BATCH_DONE):
+        self._write("UPDATE batches SET state = ? WHERE id = ?", (state, batch_id))
+
+    def unfinished_batches(self):
+        """Пакеты, которые не были завершены или отменены (например, из-за падения приложения)."""
+        with self._lock:
+            ids = [row['id'] for row in self._conn.execute(
+                "SELECT id FROM batches WHERE state = ? ORDER BY id", (BATCH_ACTIVE,))]
+        batches = []
+        for batch_id in ids:
+            batch = self.get_batch(batch_id)
+            counts = batch['counts'] = self.counts(batch_id)
+            batch['remaining'] = max(0, (batch['total'] or 0) - counts[DONE] - counts[FAILED])
+            batches.append(batch)
+        return batches
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Общая для процесса очередь заданий."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
@@ -0,0 +1,141 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+from app_paths import user_data_dir
+
+
+LOG_LEVEL_ENV = "ARTIFICIALMUSE_LOG_LEVEL"
+DEFAULT_LEVEL = "INFO"
+LOG_FILE_NAME = "artificialmuse.log"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+# Поля структурированных записей, передаваемые через extra={...}
+STRUCTURED_FIELDS = ("batch_id", "model", "attempt", "latency", "status", "path")
+
+_listener = None
+_lock = threading.Lock()
+
+
+def parse_levels(spec):
+    """
+    Разбирает уровни журнала вида "INFO" или "WARNING,engine=DEBUG,viewer=ERROR".
+    :return: (общий уровень, {имя модуля: уровень})
+    """
+    default, modules = DEFAULT_LEVEL, {}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, level = part.rpartition("=")
+        level = level.strip().upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Неизвестный уровень журнала '{level}'")
+        if sep:
+            modules[name.strip()] = level
+        else:
+            default = level
+    return default, modules
+
+
+def _structured_fields(record):
+    return {field: getattr(record, field) for field in STRUCTURED_FIELDS if getattr(record, field, None) is not None}
+
+
+class TextFormatter(logging.Formatter):
+    """Строка для консоли: время, уровень, модуль, сообщение и поля записи в виде key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s", "%H:%M:%S")
+
+    def format(self, record):
+        text = super().format(record)
+        fields = _structured_fields(record)
+        if fields:
+            text += " [" + " ".join(f"{key}={value}" for key, value in fields.items()) + "]"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON; удобно для разбора журнала программами."""
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update(_structured_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(levels=None, log_file=None, console=True, to_file=True):
+    """
+    Настраивает журнал приложения. Записи из всех потоков попадают в очередь
+    (QueueHandler), а в файл и консоль их пишет отдельный поток QueueListener,
+    поэтому потоки генерации и интерфейса не ждут ввода-вывода.
+    :param levels: строка уровней (см. parse_levels); по умолчанию из ARTIFICIALMUSE_LOG_LEVEL
+    :param log_file: путь к журналу; по умолчанию в папке приложения. Файл ротируется по размеру
+    :param console: дублировать записи в stderr
+    :param to_file: писать журнал в файл
+    :return: путь к файлу журнала или None
+    """
+    global _listener
+    default, modules = parse_levels(levels if levels is not None else os.environ.get(LOG_LEVEL_ENV))
+    if to_file:
+        log_file = log_file or os.path.join(user_data_dir("logs"), LOG_FILE_NAME)
+    else:
+        log_file = None
+
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+        handlers = []
+        if log_file:
+            try:
+                file_handler = logging.handlers.RotatingFileHandler(
+                    log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True)
+                file_handler.setFormatter(JsonFormatter())
+                handlers.append(file_handler)
+            except OSError as e:
+                print(f"Не удалось открыть журнал {log_file}: {e}", file=sys.stderr)
+                log_file = None
+        if console:
+            console_handler = logging.StreamHandler(sys.stderr)
+            console_handler.setFormatter(TextFormatter())
+            handlers.append(console_handler)
+
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        root.setLevel(default)
+        for name, level in modules.items():
+            logging.getLogger(name).setLevel(level)
+    return log_file
+
+
+def shutdown_logging():
+    """Дописывает записи из очереди и останавливает поток журнала."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -1,9 +1,12 @@
+import multiprocessing
 import sys
 from PySide6.QtWidgets import QApplication
+from logconfig import configure_logging
 from ui import ImageDownloaderApp
 
 
 def main():
+    configure_logging(console=sys.stderr is not None)
     app = QApplication(sys.argv)
     window = ImageDownloaderApp()
     window.show()
@@ -11,4 +14,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Пул кодирования запускает процессы; в собранном приложении они стартуют через этот же файл
+    multiprocessing.freeze_support()
     main()
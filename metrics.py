@@ -0,0 +1,317 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from app_paths import user_data_dir
+from atomicfile import write_atomic
+
+
+METRICS_PREFIX = "artificialmuse"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+DEFAULT_METRICS_PORT = 9464
+DEFAULT_EXPORT_INTERVAL = 15  # секунд между записями файлов метрик
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+PHASE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labelnames, labels, extra=()):
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == math.inf else repr(float(bound))
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}")
+        return tuple(str(label) for label in labels)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик."""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(f"{self.name}_total", key, (), value) for key, value in sorted(self._values.items())]
+
+    def snapshot(self):
+        with self._lock:
+            return [{'labels': dict(zip(self.labelnames, key)), 'value': value}
+                    for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """Значение, которое может расти и уменьшаться."""
+
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, *labels, value):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['counts'][index] += 1
+                    break
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry['counts']):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key, (("le", _format_bound(bound)),), cumulative))
+                samples.append((f"{self.name}_count", key, (), entry['count']))
+                samples.append((f"{self.name}_sum", key, (), entry['sum']))
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            return [{
+                'labels': dict(zip(self.labelnames, key)),
+                'count': entry['count'],
+                'sum': round(entry['sum'], 6),
+                'buckets': {_format_bound(bound): count for bound, count in zip(self.buckets, entry['counts'])},
+            } for key, entry in sorted(self._values.items())]
+
+
+class MetricsRegistry:
+    """Набор метрик процесса, отображаемый в формате OpenMetrics и в JSON."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(f"{METRICS_PREFIX}_{name}", documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(f"{METRICS_PREFIX}_{name}", documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(f"{METRICS_PREFIX}_{name}", documentation, labelnames, buckets))
+
+    def render_openmetrics(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(metric.labelnames, key, extra)} {_format_value(value)}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        return {
+            'timestamp': time.time(),
+            'metrics': {metric.name: {'type': metric.kind, 'help': metric.documentation,
+                                      'samples': metric.snapshot()} for metric in metrics},
+        }
+
+
+registry = MetricsRegistry()
+
+requests_total = registry.counter(
+    "requests", "HTTP-запросы генерации по модели и статусу ответа", ("model", "status"))
+downloaded_bytes = registry.counter(
+    "downloaded_bytes", "Получено байт изображений", ("model",))
+request_duration = registry.histogram(
+    "request_duration_seconds", "Длительность успешного запроса генерации", ("model",), LATENCY_BUCKETS)
+phase_duration = registry.histogram(
+    "phase_duration_seconds", "Длительность фаз задания генерации", ("model", "phase"), PHASE_BUCKETS)
+retries_total = registry.counter(
+    "retries", "Повторы запросов после ошибки", ("model",))
+cache_lookups = registry.counter(
+    "cache_lookups", "Обращения к кэшу результатов", ("result",))
+images_total = registry.counter(
+    "images", "Завершённые задания по модели и результату", ("model", "result"))
+output_bytes = registry.counter(
+    "output_bytes", "Записано байт итоговых файлов по формату сохранения", ("format",))
+encode_duration = registry.histogram(
+    "encode_duration_seconds", "Длительность кодирования по формату сохранения", ("format",), PHASE_BUCKETS)
+queue_depth = registry.gauge(
+    "queue_depth", "Задания активных пакетов, ещё не выполненные")
+in_flight = registry.gauge(
+    "in_flight", "Выполняющиеся задания")
+active_batches = registry.gauge(
+    "active_batches", "Выполняющиеся пакеты")
+
+
+def _atomic_write(path, text):
+    path = os.path.abspath(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, text.encode("utf-8"), fsync=False)
+
+
+def write_metrics(path=None):
+    """
+    Записывает метрики в файл OpenMetrics и рядом — JSON-снимок (то же имя с расширением .json).
+    :return: путь к файлу OpenMetrics
+    """
+    path = path or os.path.join(user_data_dir("metrics"), "metrics.prom")
+    _atomic_write(path, registry.render_openmetrics())
+    _atomic_write(os.path.splitext(path)[0] + ".json", json.dumps(registry.snapshot(), ensure_ascii=False, indent=2))
+    return path
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics":
+            body, content_type = registry.render_openmetrics().encode("utf-8"), OPENMETRICS_CONTENT_TYPE
+        elif self.path.split("?")[0] == "/metrics.json":
+            body = json.dumps(registry.snapshot(), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsExporter:
+    """
+    Публикует метрики: периодически записывает файлы и/или отдаёт их по HTTP
+    только на localhost (/metrics — OpenMetrics, /metrics.json — JSON).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._server = None
+        self._writer = None
+        self._writer_stop = None
+        self.file_path = None
+
+    def start_server(self, port=DEFAULT_METRICS_PORT):
+        """Запускает HTTP-сервер метрик. :return: фактический порт"""
+        with self._lock:
+            if self._server is None:
+                self._server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+                self._server.daemon_threads = True
+                threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            return self._server.server_address[1]
+
+    def stop_server(self):
+        with self._lock:
+            server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    def start_file_export(self, path=None, interval=DEFAULT_EXPORT_INTERVAL):
+        """Начинает периодическую запись файлов метрик. :return: путь к файлу OpenMetrics"""
+        with self._lock:
+            if self._writer is not None:
+                return self.file_path
+            self.file_path = write_metrics(path)
+            self._writer_stop = threading.Event()
+            self._writer = threading.Thread(target=self._write_periodically, args=(self._writer_stop, interval),
+                                            name="metrics-writer", daemon=True)
+            self._writer.start()
+            return self.file_path
+
+    def stop_file_export(self):
+        with self._lock:
+            writer, stop, self._writer = self._writer, self._writer_stop, None
+        if writer is not None:
+            stop.set()
+            writer.join()
+            self.flush()
+
+    def flush(self):
+        """Записывает текущие значения, если экспорт в файл включён."""
+        if self.file_path:
+            try:
+                write_metrics(self.file_path)
+            except OSError as e:
+                logger.warning("Не удалось записать метрики: %s", e)
+
+    def _write_periodically(self, stop, interval):
+        while not stop.wait(interval):
+            self.flush()
+
+
+exporter = MetricsExporter()
@@ -0,0 +1,197 @@
+import logging
+import math
+import os
+import shutil
+import threading
+
+from atomicfile import remove_quietly
+from catalog import get_catalog
+from engine import GenerationEngine
+from scheduler import PRIORITY_BACKGROUND, get_batch_scheduler
+from thumbnails import remove_thumbnail, thumbnail_path
+import metrics
+
+
+PREFETCH_DIR = ".prefetch"   # папка заготовок внутри папки сохранения: показ — переименование файла
+DEFAULT_PREFETCH_BUDGET = 8  # сколько изображений держать наготове
+
+logger = logging.getLogger(__name__)
+
+prefetched_images = metrics.registry.counter(
+    "prefetch_images", "Изображения предзагрузки: заготовлены, показаны, отброшены", ("result",))
+
+
+class Prefetcher:
+    """
+    Упреждающая генерация: пока пользователь смотрит результаты, фоновый
+    пакет создаёт ещё изображения с тем же промптом, моделями и размером
+    (следующие seed) — не больше budget — и складывает их в PREFETCH_DIR.
+    take() мгновенно переносит заготовки в папку сохранения.
+    Перед запуском любого пакета пользователя вызывается pause(): фоновый
+    пакет сразу останавливается, готовые заготовки сохраняются, а resume()
+    продолжает генерацию, когда пакеты пользователя завершены.
+    Обратный вызов on_staged(count) вызывается из потока планировщика.
+    """
+
+    def __init__(self, budget=DEFAULT_PREFETCH_BUDGET, scheduler=None, on_staged=None):
+        self.budget = budget
+        self.enabled = False
+        self.on_staged = on_staged
+        self._scheduler = scheduler
+        self._lock = threading.Lock()
+        self._target = None
+        self._staged = []
+        self._engine = None
+        self._paused = False
+        self._preempted = False  # фоновый пакет остановлен pause() и продолжится после resume()
+
+    def set_target(self, prompt, models, width, height, save_dir, next_seed=None, **options):
+        """
+        Задаёт, что предзагружать. Если изменились промпт, модели, размер или
+        папка, прежние заготовки отбрасываются.
+        :param next_seed: первый seed предзагрузки; None — случайные seed
+        :param options: настройки GenerationEngine (формат сохранения, параллельность и т. п.)
+        """
+        target = {'prompt': prompt, 'models': list(models), 'width': width, 'height': height,
+                  'save_dir': save_dir, 'seed': next_seed, 'options': options}
+        with self._lock:
+            current = self._target
+            if current is not None and all(current[key] == target[key] for key in
+                                           ('prompt', 'models', 'width', 'height', 'save_dir')):
+                current['options'] = options
+                if next_seed is not None and current['seed'] is not None:
+                    current['seed'] = max(current['seed'], next_seed)
+                return
+            self._discard_locked()
+            self._target = target
+            # Заготовки прошлых запусков приложения не учтены и уже не нужны
+            shutil.rmtree(self._staging_dir(), ignore_errors=True)
+        self._notify_staged(0)
+
+    def pause(self):
+        """Немедленно уступает соединения пакету пользователя."""
+        with self._lock:
+            self._paused = True
+            if self._engine is not None:
+                self._preempted = True
+                self._engine.stop()
+
+    def resume(self):
+        with self._lock:
+            self._paused = False
+            self._start_locked()
+
+    def set_enabled(self, enabled):
+        with self._lock:
+            self.enabled = enabled
+            if enabled:
+                self._start_locked()
+            else:
+                self._discard_locked()
+            count = len(self._staged)
+        self._notify_staged(count)
+
+    def staged_count(self):
+        with self._lock:
+            return len(self._staged)
+
+    def take(self, limit=None):
+        """
+        Переносит заготовки в папку сохранения и записывает их в каталог.
+        :return: пути показанных изображений
+        """
+        with self._lock:
+            if self._target is None:
+                return []
+            count = len(self._staged) if limit is None else limit
+            records, self._staged = self._staged[:count], self._staged[count:]
+            save_dir = self._target['save_dir']
+            paths = []
+            for record in records:
+                path = os.path.join(save_dir, os.path.basename(record['path']))
+                try:
+                    os.replace(record['path'], path)
+                except OSError as e:
+                    logger.warning("Не удалось перенести заготовку: %s", e, extra={'path': record['path']})
+                    continue
+                try:
+                    os.replace(thumbnail_path(record['path']), thumbnail_path(path))
+                except OSError:
+                    pass  # без миниатюры галерея уменьшит изображение сама
+                get_catalog().add(dict(record, path=path))
+                paths.append(path)
+            prefetched_images.inc("revealed", amount=len(paths))
+            remaining = len(self._staged)
+            self._start_locked()
+        self._notify_staged(remaining)
+        return paths
+
+    def discard(self):
+        """Останавливает предзагрузку и удаляет заготовки."""
+        with self._lock:
+            self._discard_locked()
+        self._notify_staged(0)
+
+    def _staging_dir(self):
+        return os.path.join(self._target['save_dir'], PREFETCH_DIR)
+
+    def _discard_locked(self):
+        if self._engine is not None:
+            self._engine.stop()
+            self._engine = None
+        self._preempted = False
+        for record in self._staged:
+            remove_quietly(record['path'])
+            remove_thumbnail(record['path'])
+        prefetched_images.inc("discarded", amount=len(self._staged))
+        self._staged = []
+
+    def _start_locked(self):
+        if not self.enabled or self._paused or self._target is None or self._engine is not None:
+            return
+        self._preempted = False
+        missing = self.budget - len(self._staged)
+        if missing <= 0:
+            return
+        target = self._target
+        os.makedirs(self._staging_dir(), exist_ok=True)
+        engine = GenerationEngine(
+            target['prompt'], target['width'], target['height'], target['models'], self._staging_dir(),
+            math.ceil(missing / len(target['models'])), seed=target['seed'], thumbnails=True,
+            use_catalog=False, **target['options'])
+        engine.on_result = lambda path, record: self._staged_result(engine, record)
+        engine.on_finished = lambda *args: self._engine_finished(engine)
+        self._engine = engine
+        logger.debug("Предзагрузка: %d изображений для '%s'", missing, target['prompt'])
+        scheduler = self._scheduler or get_batch_scheduler(engine.max_concurrency, engine.per_model_limit)
+        scheduler.submit(engine, PRIORITY_BACKGROUND)
+
+    def _staged_result(self, engine, record):
+        with self._lock:
+            if engine is not self._engine:
+                # Цель сменилась, пока запрос выполнялся
+                remove_quietly(record['path'])
+                remove_thumbnail(record['path'])
+                return
+            self._staged.append(dict(record, batch_id=None))
+            if self._target['seed'] is not None:
+                self._target['seed'] = max(self._target['seed'], record['seed'] + 1)
+            if len(self._staged) >= self.budget:
+                engine.stop()
+            count = len(self._staged)
+        prefetched_images.inc("staged")
+        self._notify_staged(count)
+
+    def _engine_finished(self, engine):
+        with self._lock:
+            if engine is not self._engine:
+                return
+            self._engine = None
+            # Остановленный pause() пакет продолжается, если resume() пришёл раньше его завершения;
+            # пакет, завершившийся сам (в том числе с ошибками), не перезапускается
+            if self._preempted:
+                self._start_locked()
+
+    def _notify_staged(self, count):
+        if self.on_staged is not None:
+            self.on_staged(count)
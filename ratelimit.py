@@ -0,0 +1,125 @@
+import datetime
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+DEFAULT_RATE = 2.0         # запросов в секунду на пару (хост, модель)
+DEFAULT_BURST = 4
+MIN_RATE = 0.2
+RECOVERY_FACTOR = 1.25
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value):
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата). Возвращает секунды или None."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class ThrottledError(Exception):
+    """Сервер попросил снизить частоту запросов (429/503). Задание нужно вернуть в очередь."""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"Throttled: HTTP {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Корзина токенов с адаптивной скоростью: при ответе 429/503 скорость
+    уменьшается вдвое, после каждого успешного запроса растёт в RECOVERY_FACTOR
+    раз до исходного значения.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Забирает токен. Возвращает 0 при успехе или сколько секунд нужно подождать."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def throttle(self, now, retry_after=None):
+        self._refill(now)
+        self.rate = max(MIN_RATE, self.rate / 2)
+        self.tokens = 0.0
+        pause = retry_after if retry_after is not None else 1 / self.rate
+        self.blocked_until = max(self.blocked_until, now + pause)
+
+    def recover(self):
+        self.rate = min(self.max_rate, self.rate * RECOVERY_FACTOR)
+
+
+class RateLimiter:
+    """Набор корзин токенов по ключу (хост, модель), общий для всех воркеров генерации."""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def acquire(self, key, stop_event=None):
+        """
+        Блокирует поток до получения разрешения на запрос.
+        :return: False, если ожидание прервано через stop_event
+        """
+        while True:
+            with self._lock:
+                wait = self._bucket(key).take(time.monotonic())
+            if wait <= 0:
+                return True
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+    def on_throttled(self, key, retry_after=None):
+        with self._lock:
+            self._bucket(key).throttle(time.monotonic(), retry_after)
+
+    def on_success(self, key):
+        with self._lock:
+            self._bucket(key).recover()
+
+    def current_rate(self, key):
+        with self._lock:
+            return self._bucket(key).rate
+
+
+rate_limiter = RateLimiter()
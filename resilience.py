@@ -0,0 +1,127 @@
+import random
+import threading
+import time
+
+import requests
+
+
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RESET_TIMEOUT = 60.0  # секунд до пробного запроса к отключённой модели
+
+
+def is_retryable(exc):
+    """Можно ли повторить запрос после этой ошибки (сетевые сбои и ответы 5xx)."""
+    if isinstance(exc, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        return exc.response.status_code >= 500
+    return False
+
+
+class RetryPolicy:
+    """Экспоненциальная задержка между повторами со случайным разбросом (full jitter)."""
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, base_delay=1.0, max_delay=30.0):
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, attempt, exc):
+        """
+        :param attempt: номер завершившейся неудачей попытки, начиная с 1
+        """
+        return attempt <= self.max_retries and is_retryable(exc)
+
+    def delay(self, attempt):
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, cap)
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: модель временно отключена после серии ошибок."""
+
+    def __init__(self, key):
+        super().__init__(f"Circuit open: {key}")
+        self.key = key
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для каждой модели. После failure_threshold ошибок подряд
+    запросы к модели сразу отклоняются; через reset_timeout пропускается один
+    пробный запрос (half-open), и по его результату предохранитель
+    закрывается или снова размыкается. Пробный запрос, завершившийся без
+    ответа сервера (отмена, локальная ошибка), отпускается через release();
+    если он не завершился за reset_timeout, пропускается новый.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def _state(self, key):
+        return self._states.setdefault(key, {'state': self.CLOSED, 'failures': 0, 'opened_at': 0.0,
+                                             'probe_started': 0.0})
+
+    def allow(self, key):
+        with self._lock:
+            entry = self._state(key)
+            if entry['state'] == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if entry['state'] == self.HALF_OPEN and now - entry['probe_started'] >= self.reset_timeout:
+                # Пробный запрос потерян: предохранитель снова разомкнут с момента его начала
+                entry['state'] = self.OPEN
+                entry['opened_at'] = entry['probe_started']
+            if entry['state'] == self.OPEN and now - entry['opened_at'] >= self.reset_timeout:
+                entry['state'] = self.HALF_OPEN
+                entry['probe_started'] = now
+                return True
+            return False
+
+    def release(self, key):
+        """
+        Запрос завершился, не получив ответа сервера: если это был пробный
+        запрос, следующий запрос к модели снова может стать пробным.
+        """
+        with self._lock:
+            entry = self._state(key)
+            if entry['state'] == self.HALF_OPEN:
+                entry['state'] = self.OPEN
+                entry['opened_at'] = time.monotonic() - self.reset_timeout
+
+    def record_success(self, key):
+        with self._lock:
+            entry = self._state(key)
+            entry['state'] = self.CLOSED
+            entry['failures'] = 0
+
+    def record_failure(self, key):
+        with self._lock:
+            entry = self._state(key)
+            entry['failures'] += 1
+            if entry['state'] == self.HALF_OPEN or entry['failures'] >= self.failure_threshold:
+                entry['state'] = self.OPEN
+                entry['opened_at'] = time.monotonic()
+
+    def state(self, key):
+        with self._lock:
+            return self._state(key)['state']
+
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self._states.clear()
+            else:
+                self._states.pop(key, None)
+
+
+# Общий для всех пакетов генерации: отключённая модель остаётся отключённой и в следующем пакете
+circuit_breaker = CircuitBreaker()
@@ -0,0 +1,247 @@
+import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+PRIORITY_BACKGROUND = 0
+PRIORITY_NORMAL = 1
+PRIORITY_INTERACTIVE = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "Интерактивный",
+    PRIORITY_NORMAL: "Обычный",
+    PRIORITY_BACKGROUND: "Фоновый",
+}
+
+MAX_WORKERS = 32  # верхняя граница max_concurrency, потоки пула создаются по мере надобности
+
+SCHEDULING_ROUND_ROBIN = "round_robin"
+SCHEDULING_FASTEST = "fastest"
+
+SCHEDULING_NAMES = {
+    SCHEDULING_ROUND_ROBIN: "По очереди",
+    SCHEDULING_FASTEST: "Сначала быстрые",
+}
+
+LATENCY_SMOOTHING = 0.3  # вес нового измерения в скользящем среднем задержки
+
+logger = logging.getLogger(__name__)
+
+
+class ModelLatency:
+    """Скользящее среднее времени генерации по моделям, общее для всех пакетов."""
+
+    def __init__(self, smoothing=LATENCY_SMOOTHING):
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._expected = {}
+
+    def record(self, model, seconds):
+        with self._lock:
+            previous = self._expected.get(model)
+            self._expected[model] = seconds if previous is None else previous + self.smoothing * (seconds - previous)
+
+    def expected(self, model):
+        """Ожидаемая задержка в секундах или None, если модель ещё не отвечала."""
+        with self._lock:
+            return self._expected.get(model)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._expected)
+
+
+def order_models(models, last_served, policy):
+    """
+    Упорядочивает модели для выбора следующего задания.
+    Модели, ещё не получавшие заданий, всегда идут первыми, чтобы каждая
+    выбранная модель как можно раньше дала первое изображение. Дальше при
+    SCHEDULING_ROUND_ROBIN — давно не обслуженные, при SCHEDULING_FASTEST —
+    с наименьшей ожидаемой задержкой.
+    :param last_served: model -> порядковый номер последней выдачи задания
+    """
+    if policy == SCHEDULING_FASTEST:
+        def key(model):
+            return model in last_served, model_latency.expected(model) or 0.0, last_served.get(model, -1)
+    else:
+        def key(model):
+            return last_served.get(model, -1)
+    return sorted(models, key=key)
+
+
+class _Entry:
+    def __init__(self, batch, priority, order):
+        self.batch = batch
+        self.priority = priority
+        self.served = order  # когда пакет последний раз получил слот
+        self.in_flight = 0
+
+
+class BatchScheduler:
+    """
+    Выполняет несколько пакетов в общем пуле потоков с общими ограничениями
+    на число параллельных запросов и запросов к одной модели.
+    Свободный слот получает пакет с наибольшим приоритетом; пакеты с равным
+    приоритетом обслуживаются по очереди. Новые пакеты принимаются во время
+    работы, поэтому интерактивный запрос выполняется раньше длинного фонового.
+
+    Пакет (GenerationEngine) предоставляет методы start(), has_jobs(),
+    take_job(allow_model), generate_image(job), job_finished(job, future),
+    abort(exc) и finish(). Все они, кроме generate_image, вызываются только
+    в потоке планировщика. Задание, продолжающееся вне пула потоков
+    (кодирование в пуле процессов), передаётся из job_finished в defer().
+    """
+
+    def __init__(self, max_concurrency, per_model_limit, max_workers=MAX_WORKERS):
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_model_limit = max(1, per_model_limit)
+        self.max_workers = max(max_workers, self.max_concurrency)
+        self._events = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._submitted = []
+        self._entries = []
+        self._futures = {}
+        self._deferred = {}
+        self._in_flight = {}
+        self._order = itertools.count()
+        self._thread = None
+
+    def submit(self, batch, priority=PRIORITY_NORMAL):
+        """Добавляет пакет; он начнёт выполняться при ближайшем свободном слоте."""
+        batch.scheduler = self
+        with self._lock:
+            self._submitted.append(_Entry(batch, priority, next(self._order)))
+        self.wake()
+
+    def set_priority(self, batch, priority):
+        with self._lock:
+            for entry in self._entries + self._submitted:
+                if entry.batch is batch:
+                    entry.priority = priority
+        self.wake()
+
+    def wake(self):
+        """Будит поток планировщика: изменились ограничения, приоритеты или пакет остановлен."""
+        self._events.put(None)
+
+    def batches(self):
+        with self._lock:
+            return [entry.batch for entry in self._submitted + self._entries]
+
+    def start(self):
+        """Запускает планировщик в фоновом потоке, который ждёт новые пакеты до завершения процесса."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, args=(False,), name="batch-scheduler",
+                                                daemon=True)
+                self._thread.start()
+        return self
+
+    def run_until_idle(self):
+        """Выполняет добавленные пакеты в вызывающем потоке и возвращается, когда все они завершены."""
+        self._loop(True)
+
+    def _loop(self, stop_when_idle):
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="generation") as pool:
+            while True:
+                self._admit()
+                self._dispatch(pool)
+                self._reap()
+                if stop_when_idle and not self._entries and not self._futures and not self._submitted:
+                    return
+                self._handle(self._events.get())
+                while True:
+                    try:
+                        self._handle(self._events.get_nowait())
+                    except queue.Empty:
+                        break
+
+    def _admit(self):
+        with self._lock:
+            submitted, self._submitted = self._submitted, []
+        for entry in submitted:
+            # Пакет без заданий завершится при ближайшей проверке в _reap
+            try:
+                entry.batch.start()
+            except Exception as e:
+                entry.batch.abort(e)
+            with self._lock:
+                self._entries.append(entry)
+
+    def _dispatch(self, pool):
+        while len(self._futures) < self.max_concurrency:
+            with self._lock:
+                entries = sorted(self._entries, key=lambda e: (-e.priority, e.served))
+            for entry in entries:
+                try:
+                    job = entry.batch.take_job(self._model_allowed)
+                except Exception as e:
+                    entry.batch.abort(e)
+                    continue
+                if job is not None:
+                    break
+            else:
+                return
+            entry.served = next(self._order)
+            entry.in_flight += 1
+            self._in_flight[job['model']] = self._in_flight.get(job['model'], 0) + 1
+            future = pool.submit(entry.batch.generate_image, job)
+            self._futures[future] = (entry, job)
+            future.add_done_callback(self._events.put)
+
+    def defer(self, batch, job, future):
+        """
+        Ждёт продолжения задания вне пула потоков: слот параллельности уже
+        освобождён, но пакет не завершится, пока future не выполнится; тогда
+        job_finished(job, future) будет вызван ещё раз. Только в потоке планировщика.
+        """
+        entry = next(entry for entry in self._entries if entry.batch is batch)
+        entry.in_flight += 1
+        self._deferred[future] = (entry, job)
+        future.add_done_callback(self._events.put)
+
+    def _model_allowed(self, model):
+        return self._in_flight.get(model, 0) < self.per_model_limit
+
+    def _handle(self, future):
+        if future is None:
+            return
+        if future in self._deferred:
+            entry, job = self._deferred.pop(future)
+        else:
+            entry, job = self._futures.pop(future)
+            self._in_flight[job['model']] -= 1
+        entry.in_flight -= 1
+        try:
+            entry.batch.job_finished(job, future)
+        except Exception as e:
+            entry.batch.abort(e)
+
+    def _reap(self):
+        finished = [entry for entry in self._entries if not entry.in_flight and not entry.batch.has_jobs()]
+        if not finished:
+            return
+        with self._lock:
+            self._entries = [entry for entry in self._entries if entry not in finished]
+        for entry in finished:
+            try:
+                entry.batch.finish()
+            except Exception as e:
+                logger.exception("Не удалось завершить пакет: %s", e)
+
+
+model_latency = ModelLatency()
+
+_batch_scheduler = None
+_batch_scheduler_lock = threading.Lock()
+
+
+def get_batch_scheduler(max_concurrency, per_model_limit):
+    """Общий для процесса планировщик, работающий в фоновом потоке."""
+    global _batch_scheduler
+    with _batch_scheduler_lock:
+        if _batch_scheduler is None:
+            _batch_scheduler = BatchScheduler(max_concurrency, per_model_limit).start()
+        return _batch_scheduler
@@ -0,0 +1,72 @@
+import threading
+
+
+class Flight:
+    """Выполняющийся запрос, результат которого ждут все участники с тем же ключом."""
+
+    def __init__(self):
+        self.participants = 1
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def wait(self, stop_event=None, poll_interval=0.1):
+        """
+        Ждёт результата ведущего участника.
+        :return: результат или None, если ожидание прервано через stop_event
+        :raises: исключение, с которым завершился ведущий участник
+        """
+        while not self._done.wait(poll_interval):
+            if stop_event is not None and stop_event.is_set():
+                return None
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def release(self):
+        """Отмечает, что участник закончил работу с результатом. True — если он был последним."""
+        with self._lock:
+            self.participants -= 1
+            return self.participants == 0
+
+
+class SingleFlight:
+    """
+    Объединяет одинаковые одновременные запросы: первый участник (ведущий)
+    выполняет работу, остальные ждут его результата вместо повторного запроса.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def join(self, key):
+        """
+        :return: (flight, leader) — leader=True означает, что работу должен выполнить вызывающий
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                with flight._lock:
+                    flight.participants += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def complete(self, key, flight, result=None, error=None):
+        """Публикует результат ведущего; новые участники с этим ключом начнут новый запрос."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.error = error
+        flight._done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+# Общий для всех воркеров: объединяются и запросы из разных пакетов
+inflight_requests = SingleFlight()
@@ -0,0 +1,234 @@
+import argparse
+import io
+import json
+import random
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+
+from PIL import Image
+
+
+DEFAULT_MODELS = ["flux", "turbo", "stable-diffusion", "midjourney"]
+IMAGE_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
+SEND_CHUNK_SIZE = 64 * 1024
+
+
+def parse_latency(spec):
+    """
+    Разбирает распределение задержки генерации:
+    fixed:S, uniform:MIN:MAX, normal:MEAN:SD, lognormal:MEDIAN:SIGMA, exp:MEAN (секунды).
+    :return: функция rng -> задержка в секундах
+    """
+    kind, _, rest = spec.partition(":")
+    try:
+        args = [float(value) for value in rest.split(":")] if rest else []
+        if kind == "fixed" and len(args) == 1:
+            return lambda rng: args[0]
+        if kind == "uniform" and len(args) == 2:
+            return lambda rng: rng.uniform(args[0], args[1])
+        if kind == "normal" and len(args) == 2:
+            return lambda rng: max(0.0, rng.gauss(args[0], args[1]))
+        if kind == "lognormal" and len(args) == 2:
+            return lambda rng: args[0] * rng.lognormvariate(0.0, args[1])
+        if kind == "exp" and len(args) == 1:
+            return lambda rng: rng.expovariate(1 / args[0]) if args[0] > 0 else 0.0
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"Неверное распределение задержки '{spec}'")
+
+
+def parse_image_size(value):
+    """'request' — размер из параметров запроса, иначе фиксированный ШИРИНАxВЫСОТА."""
+    if value == "request":
+        return None
+    try:
+        width, height = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Неверный размер '{value}'")
+    return width, height
+
+
+class ImageFactory:
+    """Готовит и кэширует изображения-шумы нужного размера и формата."""
+
+    def __init__(self, image_format="jpeg", fixed_size=None, max_side=4096):
+        self.image_format = image_format
+        self.fixed_size = fixed_size
+        self.max_side = max_side
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def get(self, width, height):
+        if self.fixed_size:
+            width, height = self.fixed_size
+        width = max(16, min(self.max_side, width))
+        height = max(16, min(self.max_side, height))
+        key = (width, height)
+        with self._lock:
+            data = self._images.get(key)
+            if data is None:
+                pil_format, _ = IMAGE_FORMATS[self.image_format]
+                buffer = io.BytesIO()
+                # Шум сжимается примерно как фотография, поэтому размер ответа правдоподобен
+                Image.effect_noise(key, 48).convert("RGB").save(buffer, pil_format)
+                data = self._images[key] = buffer.getvalue()
+        return data
+
+    @property
+    def content_type(self):
+        return IMAGE_FORMATS[self.image_format][1]
+
+
+class StubState:
+    """Настройки заглушки и общие для обработчиков счётчики."""
+
+    def __init__(self, latency, images, models=DEFAULT_MODELS, error_rate=0.0, rate_limit=0.0,
+                 bandwidth=0, seed=None):
+        self.latency = latency
+        self.images = images
+        self.models = list(models)
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.bandwidth = bandwidth
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = []
+        self.requests = 0
+
+    def next_latency(self):
+        with self.lock:
+            return self.latency(self.rng)
+
+    def should_fail(self):
+        with self.lock:
+            return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+    def over_rate_limit(self):
+        """Превышена ли допустимая частота запросов за последнюю секунду."""
+        if self.rate_limit <= 0:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            self.recent = [t for t in self.recent if now - t < 1.0]
+            if len(self.recent) >= self.rate_limit:
+                return True
+            self.recent.append(now)
+            return False
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Обработчик, повторяющий интерфейс API Pollinations: /prompt/<текст> и /models."""
+
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        with self.state.lock:
+            self.state.requests += 1
+
+        if url.path == "/models":
+            self._send(200, json.dumps(self.state.models).encode("utf-8"), "application/json")
+            return
+        if not url.path.startswith("/prompt/") or not unquote(url.path[len("/prompt/"):]):
+            self._send(404, b"not found", "text/plain")
+            return
+
+        if self.state.over_rate_limit():
+            self._send(429, b"too many requests", "text/plain", {"Retry-After": "1"})
+            return
+        if self.state.should_fail():
+            self._send(503, b"model unavailable", "text/plain")
+            return
+
+        query = parse_qs(url.query)
+        try:
+            width = int(query.get("width", ["1024"])[0])
+            height = int(query.get("height", ["1024"])[0])
+        except ValueError:
+            self._send(400, b"bad size", "text/plain")
+            return
+        time.sleep(self.state.next_latency())
+        self._send(200, self.state.images.get(width, height), self.state.images.content_type)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            if not self.state.bandwidth:
+                self.wfile.write(body)
+                return
+            for offset in range(0, len(body), SEND_CHUNK_SIZE):
+                chunk = body[offset:offset + SEND_CHUNK_SIZE]
+                self.wfile.write(chunk)
+                time.sleep(len(chunk) / self.state.bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def make_server(state, host="127.0.0.1", port=0):
+    """Создаёт сервер заглушки; port=0 — свободный порт. Адрес: server.server_address."""
+    handler = type("BoundStubHandler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="stub_server.py",
+        description="Локальная замена API Pollinations для замеров производительности без сети. "
+                    "Первая строка stdout — адрес сервера.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="порт (0 — любой свободный)")
+    parser.add_argument("--latency", type=parse_latency, default=parse_latency("fixed:0.2"),
+                        help="распределение задержки генерации: fixed:S, uniform:MIN:MAX, normal:MEAN:SD, "
+                             "lognormal:MEDIAN:SIGMA, exp:MEAN (по умолчанию fixed:0.2)")
+    parser.add_argument("--image-size", type=parse_image_size, default=None,
+                        help="размер ответа ШИРИНАxВЫСОТА или request — как в запросе (по умолчанию)")
+    parser.add_argument("--format", choices=sorted(IMAGE_FORMATS), default="jpeg", help="формат ответа")
+    parser.add_argument("--models", default=",".join(DEFAULT_MODELS), help="список моделей через запятую")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="запросов в секунду, сверх которых отвечать 429 (0 — без ограничения)")
+    parser.add_argument("--bandwidth", type=float, default=0,
+                        help="скорость отдачи тела ответа, байт/с (0 — без ограничения)")
+    parser.add_argument("--seed", type=int, help="seed генератора задержек и ошибок")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    state = StubState(args.latency, ImageFactory(args.format, args.image_size),
+                      models=[m for m in args.models.split(",") if m],
+                      error_rate=args.error_rate, rate_limit=args.rate_limit,
+                      bandwidth=args.bandwidth, seed=args.seed)
+    server = make_server(state, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import random
+
+
+MAX_RANDOM_SEED = 1000000
+
+
+class SweepSpec:
+    """
+    Сетка параметров генерации: промпты × размеры × seed × модели.
+    Задания не хранятся в памяти, а вычисляются по порядковому номеру, поэтому
+    сетка из миллионов комбинаций стоит столько же, сколько из одной, а общее
+    число заданий известно сразу (len).
+    Модель — самое внутреннее измерение: соседние задания относятся к разным
+    моделям, и первые результаты приходят от всех выбранных моделей.
+    """
+
+    def __init__(self, prompts, models, sizes, seed_count=1, seed_start=None, seeds=None, seed_salt=None):
+        """
+        :param sizes: список пар (ширина, высота)
+        :param seed_count: сколько seed перебирать для каждой комбинации
+        :param seed_start: первый seed диапазона; None — случайные seed
+        :param seeds: явный список seed (имеет приоритет над seed_start и seed_count)
+        :param seed_salt: основа для воспроизводимых случайных seed
+        """
+        self.prompts = list(prompts)
+        self.models = list(models)
+        self.sizes = [tuple(size) for size in sizes]
+        self.seeds = list(seeds) if seeds is not None else None
+        self.seed_count = len(self.seeds) if self.seeds is not None else max(0, seed_count)
+        self.seed_start = seed_start
+        self.seed_salt = seed_salt if seed_salt is not None else random.getrandbits(32)
+
+    def __len__(self):
+        return len(self.prompts) * len(self.sizes) * self.seed_count * len(self.models)
+
+    def seed_at(self, position):
+        if self.seeds is not None:
+            return self.seeds[position]
+        if self.seed_start is not None:
+            return self.seed_start + position
+        # Случайный, но воспроизводимый seed: продолжение пакета после сбоя запросит те же изображения
+        return random.Random(f"{self.seed_salt}:{position}").randint(1, MAX_RANDOM_SEED)
+
+    def job_at(self, seq):
+        """Возвращает задание с порядковым номером seq."""
+        rest, model_position = divmod(seq, len(self.models))
+        rest, seed_position = divmod(rest, self.seed_count)
+        prompt_position, size_position = divmod(rest, len(self.sizes))
+        width, height = self.sizes[size_position]
+        return {
+            'id': None,
+            'seq': seq,
+            'prompt': self.prompts[prompt_position],
+            'model': self.models[model_position],
+            'index': seed_position + 1,
+            'seed': self.seed_at(seed_position),
+            'width': width,
+            'height': height,
+        }
+
+    def iter_jobs(self, start=0):
+        """Лениво перебирает задания, начиная с порядкового номера start."""
+        for seq in range(start, len(self)):
+            yield self.job_at(seq)
+
+    def to_dict(self):
+        return {
+            'prompts': self.prompts,
+            'models': self.models,
+            'sizes': [list(size) for size in self.sizes],
+            'seed_count': self.seed_count,
+            'seed_start': self.seed_start,
+            'seeds': self.seeds,
+            'seed_salt': self.seed_salt,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['prompts'], data['models'], data['sizes'],
+                   seed_count=data.get('seed_count', 1),
+                   seed_start=data.get('seed_start'),
+                   seeds=data.get('seeds'),
+                   seed_salt=data.get('seed_salt'))
+
+
+class JobList:
+    """
+    Явный список заданий с тем же интерфейсом, что у SweepSpec, — например,
+    итоговые изображения для выбранных пользователем черновиков.
+    Каждое задание: prompt, model, seed, width, height и необязательные
+    index и draft_path (черновик, который заменяет итоговое изображение).
+    """
+
+    def __init__(self, jobs):
+        self.jobs = [dict(job) for job in jobs]
+        self.prompts = list(dict.fromkeys(job['prompt'] for job in self.jobs))
+        self.models = list(dict.fromkeys(job['model'] for job in self.jobs))
+        self.sizes = list(dict.fromkeys((job['width'], job['height']) for job in self.jobs))
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def job_at(self, seq):
+        job = self.jobs[seq]
+        return {
+            'id': None,
+            'seq': seq,
+            'prompt': job['prompt'],
+            'model': job['model'],
+            'index': job.get('index', seq + 1),
+            'seed': job['seed'],
+            'width': job['width'],
+            'height': job['height'],
+            'draft_path': job.get('draft_path'),
+        }
+
+    def iter_jobs(self, start=0):
+        for seq in range(start, len(self)):
+            yield self.job_at(seq)
+
+    def to_dict(self):
+        return {'jobs': self.jobs}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['jobs'])
+
+
+def spec_from_dict(data):
+    """Восстанавливает SweepSpec или JobList, сохранённые через to_dict."""
+    return JobList.from_dict(data) if 'jobs' in data else SweepSpec.from_dict(data)
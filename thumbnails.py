@@ -0,0 +1,59 @@
+import io
+import os
+import time
+
+from PIL import Image
+
+from atomicfile import remove_quietly, write_atomic
+
+
+THUMBNAIL_SIZE = 280           # сторона квадрата, в который вписывается миниатюра (как в ImageItemWidget)
+THUMBNAIL_DIR = ".thumbnails"  # папка миниатюр рядом с изображениями
+THUMBNAIL_QUALITY = 85
+
+
+def thumbnail_path(image_path):
+    """Путь миниатюры изображения: <папка>/.thumbnails/<имя файла>.jpg"""
+    directory, name = os.path.split(image_path)
+    return os.path.join(directory, THUMBNAIL_DIR, f"{name}.jpg")
+
+
+def save_thumbnail(img, image_path, size=THUMBNAIL_SIZE):
+    """
+    Сохраняет миниатюру уже декодированного изображения img для файла image_path.
+    :return: путь к миниатюре
+    """
+    if img.mode not in ("RGB", "L", "RGBA"):
+        img = img.convert("RGBA")  # палитровые и прочие режимы иначе уменьшаются без сглаживания
+    scale = min(size / img.width, size / img.height, 1.0)
+    # reducing_gap: сначала быстрое целочисленное уменьшение, затем сглаживающий фильтр;
+    # resize возвращает новое изображение, исходное остаётся нетронутым
+    img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                     Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if img.mode == "RGBA":
+        img = img.convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY)
+    path = thumbnail_path(image_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Миниатюру можно пересоздать, поэтому без fsync
+    write_atomic(path, buffer.getbuffer(), fsync=False)
+    return path
+
+
+def make_thumbnail(image_path, size=THUMBNAIL_SIZE):
+    """
+    Создаёт миниатюру сохранённого файла. JPEG декодируется сразу в уменьшенном
+    в 2–8 раз масштабе (draft), остальные форматы сначала уменьшаются
+    целочисленным reduce и только затем сглаживающим фильтром.
+    :return: {'thumbnail': с} — фаза задания, как у encoder.encode_file
+    """
+    started = time.perf_counter()
+    with Image.open(image_path) as img:
+        img.draft("RGB", (size, size))
+        save_thumbnail(img, image_path, size)
+    return {'thumbnail': time.perf_counter() - started}
+
+
+def remove_thumbnail(image_path):
+    remove_quietly(thumbnail_path(image_path))
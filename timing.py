@@ -0,0 +1,91 @@
+import time
+
+
+# Фазы задания генерации в порядке выполнения
+PHASES = ("queue", "connect", "ttfb", "transfer", "decode", "encode", "write", "thumbnail")
+
+PHASE_NAMES = {
+    "queue": "ожидание",
+    "connect": "соединение",
+    "ttfb": "до первого байта",
+    "transfer": "передача",
+    "decode": "декодирование",
+    "encode": "кодирование",
+    "write": "запись на диск",
+    "thumbnail": "миниатюра",
+}
+
+
+class RequestTiming:
+    """
+    Длительность фаз одного задания в секундах. Фазы отмечаются по ходу
+    выполнения: lap(phase) относит к фазе время, прошедшее с предыдущей отметки.
+    queue — ожидание в очереди пула, ограничителя частоты, паузы между повторами
+    и ожидание одинакового запроса; connect — DNS, TCP и TLS новых соединений;
+    ttfb — от отправки запроса до заголовков ответа (генерация на сервере).
+    """
+
+    def __init__(self):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self._mark = time.perf_counter()
+
+    def add(self, phase, seconds):
+        self.phases[phase] += max(0.0, seconds)
+
+    def lap(self, phase, exclude=0.0):
+        """Относит к фазе время с предыдущей отметки за вычетом exclude (уже учтённого в других фазах)."""
+        now = time.perf_counter()
+        elapsed = now - self._mark
+        self._mark = now
+        self.add(phase, elapsed - exclude)
+        return elapsed
+
+    def total(self):
+        return sum(self.phases.values())
+
+    def to_dict(self):
+        return {phase: round(seconds, 4) for phase, seconds in self.phases.items()}
+
+
+class TimingSummary:
+    """Сводка фаз по моделям пакета: среднее и максимум каждой фазы."""
+
+    def __init__(self):
+        self._models = {}
+
+    def add(self, model, timing):
+        entry = self._models.setdefault(model, {
+            'count': 0,
+            'total': dict.fromkeys(PHASES, 0.0),
+            'max': dict.fromkeys(PHASES, 0.0),
+        })
+        entry['count'] += 1
+        for phase, seconds in timing.phases.items():
+            entry['total'][phase] += seconds
+            entry['max'][phase] = max(entry['max'][phase], seconds)
+
+    @staticmethod
+    def _describe(count, total, maximum):
+        return {
+            'count': count,
+            'mean': {phase: round(total[phase] / count, 4) if count else 0.0 for phase in PHASES},
+            'max': {phase: round(maximum[phase], 4) for phase in PHASES},
+        }
+
+    def to_dict(self):
+        overall_total = dict.fromkeys(PHASES, 0.0)
+        overall_max = dict.fromkeys(PHASES, 0.0)
+        count = 0
+        models = {}
+        for model, entry in self._models.items():
+            models[model] = self._describe(entry['count'], entry['total'], entry['max'])
+            count += entry['count']
+            for phase in PHASES:
+                overall_total[phase] += entry['total'][phase]
+                overall_max[phase] = max(overall_max[phase], entry['max'][phase])
+        return {'models': models, 'overall': self._describe(count, overall_total, overall_max)}
+
+
+def format_phases(phases):
+    """Строка вида 'ожидание 0.12 с, соединение 0.03 с, ...' без нулевых фаз."""
+    return ", ".join(f"{PHASE_NAMES[phase]} {phases[phase]:.2f} с" for phase in PHASES if phases.get(phase))
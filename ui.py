@@ -1,3 +1,4 @@
+import logging
 import sys
 import os
 import requests
@@ -13,8 +14,23 @@ from PySide6.QtCore import Qt, QPropertyAnimation, QEasingCurve, QRect, QTimer,
 from PySide6.QtGui import QIcon, QFont, QPalette, QColor, QPainter, QPainterPath, QPixmap
 
 from downloader import DownloadImageWorker
+from engine import DEFAULT_MAX_CONCURRENCY, DEFAULT_PER_MODEL_LIMIT, DRAFT_MAX_SIDE, DRAFT_NAMES
+from http_session import get_api_base_url, get_session, warm_up
+from resilience import DEFAULT_MAX_RETRIES
+from cache import DEFAULT_CACHE_SIZE_MB, get_result_cache
+from jobqueue import BATCH_CANCELLED, get_job_queue
+from sweep import JobList, SweepSpec
+from timing import format_phases
+from encoder import OUTPUT_FORMATS, OUTPUT_NAMES, OUTPUT_PASSTHROUGH, PRESET_NAMES, encode_options
+from scheduler import (PRIORITY_NAMES, PRIORITY_NORMAL, PRIORITY_BACKGROUND, SCHEDULING_NAMES,
+                       get_batch_scheduler)
+import metrics
 from styles import Styles
 from viewer import ImagePreviewWidget
+from prefetch import DEFAULT_PREFETCH_BUDGET, Prefetcher
+
+
+logger = logging.getLogger(__name__)
 
 
 def resource_path(relative_path):
@@ -100,7 +116,101 @@ class ListWidget(QListWidget):
         self.setUniformItemSizes(True)
 
 
+class BatchProgressWidget(QFrame):
+    """Строка пакета: описание, прогресс и отмена"""
+    def __init__(self, worker, title, parent=None):
+        super().__init__(parent)
+        self.worker = worker
+        self.bytes_received = 0
+        self.is_finished = False
+
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(10)
+
+        self.title_label = QLabel(title)
+        self.title_label.setObjectName("paramLabel")
+        self.title_label.setToolTip(title)
+        self.title_label.setFixedWidth(200)
+        layout.addWidget(self.title_label)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(True)
+        self.progress_bar.setAlignment(Qt.AlignCenter)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setObjectName("ProgressBar")
+        self.progress_bar.setFormat("⏳ В очереди...")
+        layout.addWidget(self.progress_bar, 1)
+
+        self.cancel_button = QPushButton("✖")
+        self.cancel_button.setToolTip("Отменить пакет")
+        self.cancel_button.setCursor(Qt.PointingHandCursor)
+        self.cancel_button.clicked.connect(self.cancel)
+        layout.addWidget(self.cancel_button)
+
+        worker.progress.connect(self.update_progress)
+        worker.bytes_progress.connect(self.update_bytes_progress)
+        worker.finished.connect(self.batch_finished)
+
+    def cancel(self):
+        """Отменяет пакет, а после завершения убирает строку"""
+        if self.is_finished:
+            self.deleteLater()
+            return
+        self.worker.stop()
+        self.cancel_button.setEnabled(False)
+        self.progress_bar.setFormat("⏹ Отмена...")
+
+    def update_progress(self, value):
+        """Обновляет прогресс-бар"""
+        self.progress_bar.setValue(value)
+        if value < 100:
+            self.progress_bar.setFormat(f"🎨 Генерация... {value}%{self.format_bytes_received()}")
+        else:
+            self.progress_bar.setFormat("✅ Готово!")
+
+    def update_bytes_progress(self, received, expected):
+        """Обновляет объём загруженных данных в прогресс-баре"""
+        self.bytes_received = received
+        value = self.progress_bar.value()
+        if value < 100 and not self.is_finished and not self.worker.cancelled:
+            self.progress_bar.setFormat(f"🎨 Генерация... {value}%{self.format_bytes_received()}")
+
+    def format_bytes_received(self):
+        if not self.bytes_received:
+            return ""
+        return f" · {self.bytes_received / (1024 * 1024):.1f} МБ"
+
+    def batch_finished(self, success, failed_images, summary):
+        """Показывает итог пакета и средние длительности фаз по моделям"""
+        self.is_finished = True
+        timing = summary.get('timing', {}).get('models', {})
+        lines = [f"{model} ({entry['count']} шт.): {format_phases(entry['mean'])}"
+                 for model, entry in timing.items()]
+        lines += [f"{OUTPUT_NAMES.get(output_format, output_format)}: кодирование "
+                  f"{entry['encode_mean'] * 1000:.0f} мс, {entry['bytes_mean'] / (1024 * 1024):.2f} МБ на файл"
+                  for output_format, entry in summary.get('output', {}).items()]
+        jobs = summary.get('jobs')
+        if self.worker.cancelled and jobs:
+            lines.append(f"Готово {jobs['done']} из {jobs['total']}, отменено {jobs['cancelled']} "
+                         f"(прервано во время загрузки: {len(jobs['interrupted'])})")
+        if lines:
+            self.progress_bar.setToolTip("\n".join(lines))
+        if self.worker.cancelled:
+            self.progress_bar.setFormat(f"⏹ Отменено ({jobs['done']} из {jobs['total']})" if jobs else "⏹ Отменено")
+        elif success and not failed_images:
+            self.progress_bar.setFormat("✅ Все изображения готовы!")
+        elif failed_images:
+            self.progress_bar.setFormat(f"⚠️ Готово с ошибками ({len(failed_images)})")
+        else:
+            self.progress_bar.setFormat("❌ Ошибка!")
+        self.cancel_button.setEnabled(True)
+        self.cancel_button.setToolTip("Убрать из списка")
+
+
 class ImageDownloaderApp(QWidget):
+    prefetch_staged = Signal(int)  # число готовых заготовок; испускается из потока планировщика
+
     def __init__(self):
         super().__init__()
         self.current_style = "dark"
@@ -112,7 +222,11 @@ class ImageDownloaderApp(QWidget):
         ]
         self.save_dir = ""
         self.styles = Styles()
+        self.running_workers = set()
+        self.prefetcher = Prefetcher(on_staged=self.prefetch_staged.emit)
         self.init_ui()
+        self.prefetch_staged.connect(self.update_prefetch_button)
+        QTimer.singleShot(0, self.offer_resume_batches)
 
     def init_ui(self):
         self.setWindowIcon(QIcon(resource_path("resources/icon.png")))
@@ -152,6 +266,7 @@ class ImageDownloaderApp(QWidget):
 
         # Настройка пресетов размеров
         self.setup_size_presets()
+        self.update_sweep_total()
 
     def create_left_panel(self):
         """Создает левую панель с настройками"""
@@ -176,6 +291,8 @@ class ImageDownloaderApp(QWidget):
         tabs.addTab(generate_tab, "🎯 Генерация")
         tabs.addTab(settings_tab, "⚙️ Настройки")
         tabs.addTab(about_tab, "ℹ️ О программе")
+        self.generate_tab = generate_tab
+        tabs.currentChanged.connect(self.tab_changed)
         
         layout.addWidget(tabs)
 
@@ -228,6 +345,10 @@ class ImageDownloaderApp(QWidget):
         params_card = self.create_parameters_card()
         layout.addWidget(params_card)
 
+        # Карточка перебора параметров
+        sweep_card = self.create_sweep_card()
+        layout.addWidget(sweep_card)
+
         layout.addStretch()
         scroll.setWidget(content)
         
@@ -252,6 +373,7 @@ class ImageDownloaderApp(QWidget):
         self.input_prompt.setPlaceholderText("Например: Кот в космосе в стиле Ван Гога, детализированно, 4K качество...")
         self.input_prompt.setMaximumHeight(100)
         self.input_prompt.setObjectName("promptInput")
+        self.input_prompt.textChanged.connect(warm_up)
         layout.addWidget(self.input_prompt)
 
         return card
@@ -325,7 +447,7 @@ class ImageDownloaderApp(QWidget):
         count_label = QLabel("Количество:")
         count_label.setObjectName("paramLabel")
         self.input_count = StyledSpinBox()
-        self.input_count.setRange(1, 50)
+        self.input_count.setRange(1, 100000)
         self.input_count.setValue(1)
         self.input_count.setSuffix(" шт.")
 
@@ -356,9 +478,83 @@ class ImageDownloaderApp(QWidget):
         params_grid.addWidget(QLabel("Высота:"), 3, 0)
         params_grid.addWidget(self.input_height, 3, 1)
 
+        # Фиксированный seed делает генерацию воспроизводимой и позволяет брать результаты из кэша
+        self.seed_checkbox = CheckBox("Фиксированный seed")
+        self.input_seed = StyledSpinBox()
+        self.input_seed.setRange(1, 1000000)
+        self.input_seed.setValue(42)
+        self.input_seed.setEnabled(False)
+        self.input_seed.setToolTip("Изображение N каждой комбинации получает seed + N - 1")
+        self.seed_checkbox.toggled.connect(self.input_seed.setEnabled)
+
+        params_grid.addWidget(self.seed_checkbox, 4, 0)
+        params_grid.addWidget(self.input_seed, 4, 1)
+
+        # Пакет с большим приоритетом получает свободные слоты раньше уже выполняющихся
+        priority_label = QLabel("Приоритет:")
+        priority_label.setObjectName("paramLabel")
+        self.combo_priority = StyledComboBox()
+        for priority, name in PRIORITY_NAMES.items():
+            self.combo_priority.addItem(name, priority)
+        self.combo_priority.setCurrentIndex(self.combo_priority.findData(PRIORITY_NORMAL))
+
+        params_grid.addWidget(priority_label, 5, 0)
+        params_grid.addWidget(self.combo_priority, 5, 1)
+
+        # Черновики: быстрый просмотр в малом размере до запроса полного
+        draft_label = QLabel("Черновики:")
+        draft_label.setObjectName("paramLabel")
+        self.combo_draft = StyledComboBox()
+        for mode, name in DRAFT_NAMES.items():
+            self.combo_draft.addItem(name, mode)
+        self.combo_draft.setToolTip(
+            f"Изображения больше {DRAFT_MAX_SIDE} px сначала запрашиваются в малом размере.\n"
+            "«Черновик, затем итоговое» — полный размер запрашивается сразу после черновика.\n"
+            "«Только черновики» — полный размер запрашивается только для выбранных черновиков\n"
+            "(контекстное меню галереи), отклонённые черновики не стоят полноразмерного запроса.")
+
+        params_grid.addWidget(draft_label, 6, 0)
+        params_grid.addWidget(self.combo_draft, 6, 1)
+
         layout.addLayout(params_grid)
         return card
 
+    def create_sweep_card(self):
+        """Создает карточку перебора промптов и размеров"""
+        card = Card()
+        layout = QVBoxLayout(card)
+        layout.setContentsMargins(25, 20, 25, 20)
+        layout.setSpacing(15)
+
+        title = QLabel("🧮 Перебор параметров")
+        title.setObjectName("cardTitle")
+        layout.addWidget(title)
+
+        self.split_prompts_checkbox = CheckBox("Каждая строка описания — отдельный промпт")
+        layout.addWidget(self.split_prompts_checkbox)
+
+        sizes_label = QLabel("Дополнительные размеры:")
+        sizes_label.setObjectName("paramLabel")
+        layout.addWidget(sizes_label)
+
+        # Заполняется в setup_size_presets
+        self.sweep_size_list = ListWidget()
+        self.sweep_size_list.setMaximumHeight(150)
+        layout.addWidget(self.sweep_size_list)
+
+        self.sweep_total_label = QLabel()
+        self.sweep_total_label.setObjectName("pathLabel")
+        layout.addWidget(self.sweep_total_label)
+
+        # Задания перебора создаются по мере генерации, общее число известно заранее
+        for signal in (self.input_prompt.textChanged, self.split_prompts_checkbox.toggled,
+                       self.input_count.valueChanged, self.local_model_list.itemChanged,
+                       self.remote_model_list.itemChanged, self.sweep_size_list.itemChanged,
+                       self.input_width.valueChanged, self.input_height.valueChanged):
+            signal.connect(self.update_sweep_total)
+
+        return card
+
     def create_settings_tab(self):
         """Создает вкладку настроек"""
         tab = QWidget()
@@ -409,6 +605,186 @@ class ImageDownloaderApp(QWidget):
         theme_layout.addLayout(theme_buttons_layout)
 
         layout.addWidget(theme_card)
+
+        # Карточка производительности
+        performance_card = Card()
+        performance_layout = QVBoxLayout(performance_card)
+        performance_layout.setContentsMargins(25, 20, 25, 20)
+        performance_layout.setSpacing(15)
+
+        performance_title = QLabel("⚡ Производительность")
+        performance_title.setObjectName("cardTitle")
+        performance_layout.addWidget(performance_title)
+
+        performance_grid = QGridLayout()
+        performance_grid.setSpacing(15)
+
+        self.input_max_concurrency = StyledSpinBox()
+        self.input_max_concurrency.setRange(1, 32)
+        self.input_max_concurrency.setValue(DEFAULT_MAX_CONCURRENCY)
+        self.input_max_concurrency.setToolTip("Сколько запросов генерации выполняется одновременно")
+
+        self.input_per_model_limit = StyledSpinBox()
+        self.input_per_model_limit.setRange(1, 32)
+        self.input_per_model_limit.setValue(DEFAULT_PER_MODEL_LIMIT)
+        self.input_per_model_limit.setToolTip("Максимум одновременных запросов к одной модели")
+
+        self.input_max_concurrency.valueChanged.connect(self.scheduler_limits_changed)
+        self.input_per_model_limit.valueChanged.connect(self.scheduler_limits_changed)
+
+        performance_grid.addWidget(QLabel("Параллельных запросов:"), 0, 0)
+        performance_grid.addWidget(self.input_max_concurrency, 0, 1)
+        performance_grid.addWidget(QLabel("На одну модель:"), 1, 0)
+        performance_grid.addWidget(self.input_per_model_limit, 1, 1)
+
+        self.input_max_retries = StyledSpinBox()
+        self.input_max_retries.setRange(0, 10)
+        self.input_max_retries.setValue(DEFAULT_MAX_RETRIES)
+        self.input_max_retries.setToolTip("Сколько раз повторять запрос после сетевой ошибки или ответа 5xx")
+
+        performance_grid.addWidget(QLabel("Повторов при ошибке:"), 2, 0)
+        performance_grid.addWidget(self.input_max_retries, 2, 1)
+
+        self.combo_scheduling = StyledComboBox()
+        for policy, name in SCHEDULING_NAMES.items():
+            self.combo_scheduling.addItem(name, policy)
+        self.combo_scheduling.setToolTip(
+            "Каждая модель сначала получает по одному запросу, затем модели чередуются "
+            "или первыми идут модели, которые отвечают быстрее")
+
+        performance_grid.addWidget(QLabel("Порядок моделей:"), 3, 0)
+        performance_grid.addWidget(self.combo_scheduling, 3, 1)
+        performance_layout.addLayout(performance_grid)
+
+        cache_layout = QHBoxLayout()
+        self.cache_checkbox = CheckBox("Кэшировать результаты")
+        self.cache_checkbox.setChecked(True)
+        self.cache_checkbox.setToolTip(
+            "Повторный запрос с теми же промптом, моделью, seed и размером берётся с диска без обращения к API")
+        self.input_cache_size = StyledSpinBox()
+        self.input_cache_size.setRange(64, 65536)
+        self.input_cache_size.setSingleStep(256)
+        self.input_cache_size.setValue(DEFAULT_CACHE_SIZE_MB)
+        self.input_cache_size.setSuffix(" МБ")
+        self.input_cache_size.valueChanged.connect(self.cache_size_changed)
+        cache_layout.addWidget(self.cache_checkbox)
+        cache_layout.addWidget(self.input_cache_size)
+        performance_layout.addLayout(cache_layout)
+
+        prefetch_layout = QHBoxLayout()
+        self.prefetch_checkbox = CheckBox("Предзагружать ещё изображения")
+        self.prefetch_checkbox.setToolTip(
+            "Пока вы смотрите результаты, в фоне генерируются следующие seed с тем же промптом и моделями; "
+            "кнопка «Ещё» показывает их мгновенно")
+        self.prefetch_checkbox.toggled.connect(self.prefetcher.set_enabled)
+        self.input_prefetch_budget = StyledSpinBox()
+        self.input_prefetch_budget.setRange(1, 100)
+        self.input_prefetch_budget.setValue(DEFAULT_PREFETCH_BUDGET)
+        self.input_prefetch_budget.setSuffix(" шт.")
+        self.input_prefetch_budget.setToolTip("Сколько изображений держать наготове")
+        self.input_prefetch_budget.valueChanged.connect(self.prefetch_budget_changed)
+        prefetch_layout.addWidget(self.prefetch_checkbox)
+        prefetch_layout.addWidget(self.input_prefetch_budget)
+        performance_layout.addLayout(prefetch_layout)
+
+        layout.addWidget(performance_card)
+
+        # Карточка формата сохранения
+        output_card = Card()
+        output_layout = QVBoxLayout(output_card)
+        output_layout.setContentsMargins(25, 20, 25, 20)
+        output_layout.setSpacing(15)
+
+        output_title = QLabel("💾 Формат сохранения")
+        output_title.setObjectName("cardTitle")
+        output_layout.addWidget(output_title)
+
+        output_grid = QGridLayout()
+        output_grid.setSpacing(15)
+
+        self.combo_output_format = StyledComboBox()
+        for output_format, name in OUTPUT_NAMES.items():
+            self.combo_output_format.addItem(name, output_format)
+        self.combo_output_format.setToolTip(
+            "«Как есть» записывает ответ сервера без распаковки и повторного сжатия — быстрее всего")
+
+        self.combo_output_preset = StyledComboBox()
+        for preset, name in PRESET_NAMES.items():
+            self.combo_output_preset.addItem(name, preset)
+        self.combo_output_preset.setToolTip("Быстрее — меньше времени на кодирование, меньше — меньше файлы")
+
+        self.input_output_quality = StyledSpinBox()
+        self.input_output_quality.setRange(1, 100)
+        self.output_progressive_checkbox = CheckBox("Прогрессивный JPEG")
+        self.input_webp_method = StyledSpinBox()
+        self.input_webp_method.setRange(0, 6)
+        self.input_webp_method.setToolTip("0 — быстрее, 6 — меньше файлы")
+        self.input_png_compress = StyledSpinBox()
+        self.input_png_compress.setRange(0, 9)
+        self.input_png_compress.setToolTip("0 — без сжатия, 9 — максимальное сжатие")
+
+        output_grid.addWidget(QLabel("Формат:"), 0, 0)
+        output_grid.addWidget(self.combo_output_format, 0, 1)
+        output_grid.addWidget(QLabel("Профиль:"), 1, 0)
+        output_grid.addWidget(self.combo_output_preset, 1, 1)
+        # Параметры кодировщика: строка показывается, если формат её поддерживает
+        self.output_parameter_rows = {}
+        for row, (parameter, caption, widget) in enumerate((
+                ("quality", "Качество:", self.input_output_quality),
+                ("progressive", None, self.output_progressive_checkbox),
+                ("method", "Метод WebP:", self.input_webp_method),
+                ("compress_level", "Сжатие PNG:", self.input_png_compress)), start=2):
+            label = QLabel(caption) if caption else None
+            if label is not None:
+                output_grid.addWidget(label, row, 0)
+                output_grid.addWidget(widget, row, 1)
+            else:
+                output_grid.addWidget(widget, row, 0, 1, 2)
+            self.output_parameter_rows[parameter] = [w for w in (label, widget) if w is not None]
+        output_layout.addLayout(output_grid)
+
+        self.combo_output_format.currentIndexChanged.connect(self.output_preset_changed)
+        self.combo_output_preset.currentIndexChanged.connect(self.output_preset_changed)
+        self.output_preset_changed()
+
+        layout.addWidget(output_card)
+
+        # Карточка метрик
+        metrics_card = Card()
+        metrics_layout = QVBoxLayout(metrics_card)
+        metrics_layout.setContentsMargins(25, 20, 25, 20)
+        metrics_layout.setSpacing(15)
+
+        metrics_title = QLabel("📈 Метрики")
+        metrics_title.setObjectName("cardTitle")
+        metrics_layout.addWidget(metrics_title)
+
+        self.metrics_file_checkbox = CheckBox("Записывать метрики в файл")
+        self.metrics_file_checkbox.setToolTip(
+            "Счётчики запросов, ошибок, повторов, объёма и задержек в формате OpenMetrics "
+            "и JSON-снимок; файлы обновляются во время генерации")
+        self.metrics_file_checkbox.toggled.connect(self.metrics_file_toggled)
+        metrics_layout.addWidget(self.metrics_file_checkbox)
+
+        self.metrics_path_label = QLabel("")
+        self.metrics_path_label.setObjectName("pathLabel")
+        self.metrics_path_label.setWordWrap(True)
+        self.metrics_path_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        metrics_layout.addWidget(self.metrics_path_label)
+
+        metrics_server_layout = QHBoxLayout()
+        self.metrics_server_checkbox = CheckBox("Доступ по HTTP на localhost, порт")
+        self.metrics_server_checkbox.setToolTip(
+            "Адреса /metrics (OpenMetrics) и /metrics.json доступны только с этого компьютера")
+        self.metrics_server_checkbox.toggled.connect(self.metrics_server_toggled)
+        self.input_metrics_port = StyledSpinBox()
+        self.input_metrics_port.setRange(1024, 65535)
+        self.input_metrics_port.setValue(metrics.DEFAULT_METRICS_PORT)
+        metrics_server_layout.addWidget(self.metrics_server_checkbox)
+        metrics_server_layout.addWidget(self.input_metrics_port)
+        metrics_layout.addLayout(metrics_server_layout)
+
+        layout.addWidget(metrics_card)
         layout.addStretch()
 
         return tab
@@ -468,15 +844,38 @@ class ImageDownloaderApp(QWidget):
         self.generate_button.setObjectName("generateButton")
         self.generate_button.setMinimumHeight(50)
         self.generate_button.clicked.connect(self.start_download)
-        layout.addWidget(self.generate_button)
 
-        # Прогресс-бар
-        self.progress_bar = QProgressBar()
-        self.progress_bar.setTextVisible(True)
-        self.progress_bar.setAlignment(Qt.AlignCenter)
-        self.progress_bar.setValue(0)
-        self.progress_bar.setObjectName("ProgressBar")
-        layout.addWidget(self.progress_bar)
+        # Остановка всех пакетов: выполняемые запросы обрываются сразу
+        self.stop_button = AnimatedButton("⏹ Остановить")
+        self.stop_button.setMinimumHeight(50)
+        self.stop_button.setToolTip("Отменить все выполняющиеся пакеты")
+        self.stop_button.clicked.connect(self.stop_all)
+        self.stop_button.setEnabled(False)
+
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addWidget(self.generate_button, 1)
+        buttons_layout.addWidget(self.stop_button)
+        layout.addLayout(buttons_layout)
+
+        # Показ предзагруженных изображений
+        self.more_button = AnimatedButton()
+        self.more_button.clicked.connect(self.show_prefetched)
+        self.more_button.setVisible(False)
+        layout.addWidget(self.more_button)
+
+        # Выполняющиеся пакеты, у каждого свой прогресс и отмена
+        batches_scroll = QScrollArea()
+        batches_scroll.setWidgetResizable(True)
+        batches_scroll.setFrameStyle(QFrame.NoFrame)
+        batches_scroll.setMaximumHeight(180)
+
+        batches_content = QWidget()
+        self.batches_layout = QVBoxLayout(batches_content)
+        self.batches_layout.setContentsMargins(0, 0, 0, 0)
+        self.batches_layout.setSpacing(8)
+        self.batches_layout.addStretch()
+        batches_scroll.setWidget(batches_content)
+        layout.addWidget(batches_scroll)
 
         return panel
 
@@ -492,6 +891,7 @@ class ImageDownloaderApp(QWidget):
         layout.addWidget(title)
 
         self.preview = ImagePreviewWidget()
+        self.preview.finals_requested.connect(self.start_finals)
         layout.addWidget(self.preview)
 
         return panel
@@ -525,6 +925,13 @@ class ImageDownloaderApp(QWidget):
         for preset in presets:
             self.combo_preset.addItem(preset)
 
+        for index, preset in enumerate(presets[1:], 1):
+            item = QListWidgetItem(preset)
+            item.setData(Qt.UserRole, index)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Unchecked)
+            self.sweep_size_list.addItem(item)
+
         self.combo_preset.currentIndexChanged.connect(self.preset_changed)
         self.preset_changed(0)
 
@@ -564,6 +971,147 @@ class ImageDownloaderApp(QWidget):
             self.input_width.setEnabled(False)
             self.input_height.setEnabled(False)
 
+    def selected_models(self):
+        """Возвращает отмеченные локальные и удаленные модели"""
+        models = []
+        for model_list, marker in ((self.local_model_list, "🎨 "), (self.remote_model_list, "🔗 ")):
+            for i in range(model_list.count()):
+                item = model_list.item(i)
+                if item.checkState() == Qt.Checked:
+                    models.append(item.text().replace(marker, ""))
+        return models
+
+    def sweep_prompts(self):
+        """Возвращает промпты пакета: весь текст или каждую непустую строку"""
+        text = self.input_prompt.toPlainText().strip()
+        if not self.split_prompts_checkbox.isChecked():
+            return [text] if text else []
+        return [line.strip() for line in text.splitlines() if line.strip()]
+
+    def sweep_sizes(self):
+        """Возвращает размеры пакета: текущий и отмеченные дополнительные, без повторов"""
+        sizes = [(self.input_width.value(), self.input_height.value())]
+        for i in range(self.sweep_size_list.count()):
+            item = self.sweep_size_list.item(i)
+            size = self.preset_sizes[item.data(Qt.UserRole)]
+            if item.checkState() == Qt.Checked and size not in sizes:
+                sizes.append(size)
+        return sizes
+
+    def update_sweep_total(self, *args):
+        """Показывает, сколько изображений будет сгенерировано"""
+        prompts = len(self.sweep_prompts())
+        sizes = len(self.sweep_sizes())
+        models = len(self.selected_models())
+        count = self.input_count.value()
+        self.sweep_total_label.setText(
+            f"Промптов: {prompts} × размеров: {sizes} × моделей: {models} × seed: {count} = "
+            f"{prompts * sizes * models * count} изображений")
+
+    def tab_changed(self, index):
+        """Прогревает соединение с API при переходе на вкладку генерации"""
+        tabs = self.sender()
+        if tabs is not None and tabs.widget(index) is self.generate_tab:
+            warm_up()
+
+    def batch_scheduler(self):
+        """Возвращает общий планировщик пакетов с текущими ограничениями"""
+        scheduler = get_batch_scheduler(self.input_max_concurrency.value(), self.input_per_model_limit.value())
+        self.scheduler_limits_changed()
+        return scheduler
+
+    def scheduler_limits_changed(self, *args):
+        """Применяет общие ограничения параллельности ко всем пакетам"""
+        scheduler = get_batch_scheduler(self.input_max_concurrency.value(), self.input_per_model_limit.value())
+        scheduler.max_concurrency = self.input_max_concurrency.value()
+        scheduler.per_model_limit = self.input_per_model_limit.value()
+        scheduler.wake()
+
+    def cache_size_changed(self, value):
+        """Меняет допустимый размер кэша результатов"""
+        get_result_cache().max_bytes = value * 1024 * 1024
+
+    def output_preset_changed(self, *args):
+        """Заполняет параметры кодировщика значениями профиля и показывает поддерживаемые форматом"""
+        output_format = self.combo_output_format.currentData()
+        passthrough = output_format == OUTPUT_PASSTHROUGH
+        self.combo_output_preset.setEnabled(not passthrough)
+        parameters = () if passthrough else OUTPUT_FORMATS[output_format]['parameters']
+        for parameter, widgets in self.output_parameter_rows.items():
+            for widget in widgets:
+                widget.setVisible(parameter in parameters)
+        if passthrough:
+            return
+        options = encode_options(output_format, self.combo_output_preset.currentData())
+        if 'quality' in options:
+            self.input_output_quality.setValue(options['quality'])
+        if 'progressive' in options:
+            self.output_progressive_checkbox.setChecked(options['progressive'])
+        if 'method' in options:
+            self.input_webp_method.setValue(options['method'])
+        if 'compress_level' in options:
+            self.input_png_compress.setValue(options['compress_level'])
+
+    def output_settings(self):
+        """
+        Возвращает выбранный формат сохранения и настройки кодировщика
+        :return: (формат, настройки или None для сохранения как есть)
+        """
+        output_format = self.combo_output_format.currentData()
+        if output_format == OUTPUT_PASSTHROUGH:
+            return output_format, None
+        return output_format, encode_options(
+            output_format, self.combo_output_preset.currentData(),
+            quality=self.input_output_quality.value(),
+            progressive=self.output_progressive_checkbox.isChecked(),
+            method=self.input_webp_method.value(),
+            compress_level=self.input_png_compress.value())
+
+    def metrics_file_toggled(self, checked):
+        """Включает или выключает периодическую запись метрик в файл"""
+        if not checked:
+            metrics.exporter.stop_file_export()
+            self.metrics_path_label.setText("")
+            return
+        try:
+            path = metrics.exporter.start_file_export()
+        except OSError as e:
+            QMessageBox.warning(self, "Метрики", f"Не удалось записать файл метрик: {e}")
+            self.metrics_file_checkbox.setChecked(False)
+            return
+        self.metrics_path_label.setText(f"{path}\n{os.path.splitext(path)[0]}.json")
+
+    def metrics_server_toggled(self, checked):
+        """Запускает или останавливает HTTP-сервер метрик"""
+        self.input_metrics_port.setEnabled(not checked)
+        if not checked:
+            metrics.exporter.stop_server()
+            self.metrics_server_checkbox.setToolTip(
+                "Адреса /metrics (OpenMetrics) и /metrics.json доступны только с этого компьютера")
+            return
+        try:
+            port = metrics.exporter.start_server(self.input_metrics_port.value())
+        except OSError as e:
+            QMessageBox.warning(self, "Метрики", f"Не удалось открыть порт {self.input_metrics_port.value()}: {e}")
+            self.metrics_server_checkbox.setChecked(False)
+            return
+        self.metrics_server_checkbox.setToolTip(f"http://127.0.0.1:{port}/metrics")
+
+    def prefetch_budget_changed(self, value):
+        """Меняет число заготовок; уже готовые сверх нового бюджета остаются"""
+        self.prefetcher.budget = value
+
+    def update_prefetch_button(self, count):
+        self.more_button.setText(f"✨ Ещё ({count} готово)")
+        self.more_button.setEnabled(count > 0)
+        self.more_button.setVisible(self.prefetcher.enabled)
+
+    def show_prefetched(self):
+        """Мгновенно показывает изображения, сгенерированные заранее"""
+        paths = self.prefetcher.take()
+        if paths:
+            self.preview.add_images(paths)
+
     def select_folder(self):
         """Выбор папки для сохранения"""
         start_dir = self.save_dir if self.save_dir else os.path.expanduser("~")
@@ -583,7 +1131,7 @@ class ImageDownloaderApp(QWidget):
         QApplication.processEvents()
 
         try:
-            response = requests.get("https://image.pollinations.ai/models", timeout=20)
+            response = get_session().get(f"{get_api_base_url()}/models", timeout=20)
             if response.status_code == 200:
                 models = response.json()
                 if isinstance(models, list) and all(isinstance(m, str) for m in models):
@@ -610,28 +1158,15 @@ class ImageDownloaderApp(QWidget):
 
     def start_download(self):
         """Запускает процесс генерации изображений"""
-        prompt = self.input_prompt.toPlainText().strip()
+        prompts = self.sweep_prompts()
         count = self.input_count.value()
-        width = self.input_width.value()
-        height = self.input_height.value()
-
-        # Собираем выбранные модели
-        local_selected = []
-        for i in range(self.local_model_list.count()):
-            item = self.local_model_list.item(i)
-            if item.checkState() == Qt.Checked:
-                local_selected.append(item.text().replace("🎨 ", ""))
-
-        remote_selected = []
-        for i in range(self.remote_model_list.count()):
-            item = self.remote_model_list.item(i)
-            if item.checkState() == Qt.Checked:
-                remote_selected.append(item.text().replace("🔗 ", ""))
-
-        all_models = local_selected + remote_selected
+        sizes = self.sweep_sizes()
+        width, height = sizes[0]
+        seed = self.input_seed.value() if self.seed_checkbox.isChecked() else None
+        all_models = self.selected_models()
 
         # Валидация
-        if not prompt:
+        if not prompts:
             QMessageBox.warning(self, "Ошибка", "Введите описание изображения!")
             return
         if not all_models:
@@ -641,68 +1176,146 @@ class ImageDownloaderApp(QWidget):
             QMessageBox.warning(self, "Ошибка", "Выберите папку для сохранения!")
             return
 
-        # Отключаем интерфейс
-        self.set_ui_enabled(False)
-        self.progress_bar.setValue(0)
-        self.progress_bar.setFormat("🚀 Начинаем генерацию...")
-
         # Запускаем воркер
-        self.worker = DownloadImageWorker(
-            prompt=prompt,
+        self.start_worker(DownloadImageWorker(
+            prompt=prompts[0],
             final_width=width,
             final_height=height,
             models=all_models,
             save_dir=self.save_dir,
-            count=count
-        )
-        
-        self.worker.progress.connect(self.update_progress)
-        self.worker.finished.connect(self.download_finished)
-        self.worker.image_generated.connect(self.preview.add_image)
-        self.worker.error_occurred.connect(self.show_generation_error)
-        self.worker.start()
-
-    def set_ui_enabled(self, enabled):
-        """Включает/выключает элементы интерфейса"""
-        self.generate_button.setEnabled(enabled)
-        self.folder_button.setEnabled(enabled)
-        self.refresh_models_button.setEnabled(enabled)
-        self.input_prompt.setEnabled(enabled)
-        self.input_count.setEnabled(enabled)
-        self.combo_preset.setEnabled(enabled)
-        self.local_model_list.setEnabled(enabled)
-        self.remote_model_list.setEnabled(enabled)
-        
-        if not enabled:
-            self.generate_button.setText("⏳ Генерация...")
-        else:
-            self.generate_button.setText("🚀 Начать генерацию")
+            count=count,
+            seed=seed,
+            draft=self.combo_draft.currentData(),
+            sweep=SweepSpec(prompts, all_models, sizes, seed_count=count, seed_start=seed),
+            **self.generation_options()
+        ))
+
+        # «Ещё такие же»: следующие seed первого промпта и размера
+        options = self.generation_options()
+        for key in ('thumbnails', 'job_queue', 'priority'):
+            del options[key]
+        self.prefetcher.set_target(prompts[0], all_models, width, height, self.save_dir,
+                                   next_seed=seed + count if seed is not None else None, **options)
+
+    def generation_options(self):
+        """Общие настройки пакетов из вкладки настроек"""
+        output_format, output_options = self.output_settings()
+        return {
+            'max_concurrency': self.input_max_concurrency.value(),
+            'per_model_limit': self.input_per_model_limit.value(),
+            'output_format': output_format,
+            'output_options': output_options,
+            'thumbnails': True,
+            'max_retries': self.input_max_retries.value(),
+            'use_cache': self.cache_checkbox.isChecked(),
+            'scheduling': self.combo_scheduling.currentData(),
+            'job_queue': get_job_queue(),
+            'priority': self.combo_priority.currentData(),
+        }
 
-    def update_progress(self, value):
-        """Обновляет прогресс-бар"""
-        self.progress_bar.setValue(value)
-        if value < 100:
-            self.progress_bar.setFormat(f"🎨 Генерация... {value}%")
+    def start_finals(self, drafts):
+        """Запускает пакеты итоговых изображений для выбранных черновиков (по пакету на папку)"""
+        by_dir = {}
+        for draft in drafts:
+            # Черновики лежат в подпапке drafts папки сохранения
+            save_dir = os.path.dirname(os.path.dirname(draft['draft_path']))
+            by_dir.setdefault(save_dir, []).append(draft)
+        for save_dir, jobs in by_dir.items():
+            spec = JobList(jobs)
+            self.start_worker(DownloadImageWorker(
+                prompt=jobs[0]['prompt'],
+                final_width=jobs[0]['width'],
+                final_height=jobs[0]['height'],
+                models=spec.models,
+                save_dir=save_dir,
+                count=len(jobs),
+                sweep=spec,
+                **self.generation_options()
+            ))
+
+    def start_worker(self, worker):
+        """Добавляет строку пакета и передаёт пакет планировщику"""
+        engine = worker.engine
+        title = f"{PRIORITY_NAMES[worker.priority]} · {engine.prompt}"
+        row = BatchProgressWidget(worker, title)
+        self.batches_layout.insertWidget(self.batches_layout.count() - 1, row)
+
+        # Фоновая предзагрузка уступает соединения пакету пользователя
+        self.prefetcher.pause()
+        self.running_workers.add(worker)
+        self.stop_button.setEnabled(True)
+        worker.finished.connect(self.worker_stopped)
+        worker.finished.connect(self.download_finished)
+        worker.images_generated.connect(self.preview.add_images)
+        worker.drafts_generated.connect(self.preview.add_drafts)
+        worker.drafts_finalized.connect(self.preview.finalize_drafts)
+        worker.error_occurred.connect(self.show_generation_error)
+        worker.start(self.batch_scheduler())
+
+    def worker_stopped(self, *args):
+        """Возобновляет предзагрузку, когда пакетов пользователя не осталось"""
+        self.running_workers.discard(self.sender())
+        if not self.running_workers:
+            self.stop_button.setEnabled(False)
+            self.prefetcher.resume()
+
+    def stop_all(self):
+        """Отменяет все выполняющиеся пакеты"""
+        for worker in list(self.running_workers):
+            worker.stop()
+        self.stop_button.setEnabled(False)
+
+    def closeEvent(self, event):
+        """
+        Останавливает пакеты и предзагрузку: иначе потоки генерации держат
+        процесс, пока не закончатся их запросы. Незавершённые пакеты
+        остаются в очереди и будут предложены при следующем запуске.
+        """
+        self.prefetcher.discard()
+        for worker in list(self.running_workers):
+            worker.stop(resumable=True)
+        super().closeEvent(event)
+
+    def offer_resume_batches(self):
+        """Предлагает продолжить пакеты, прерванные падением или закрытием приложения"""
+        job_queue = get_job_queue()
+        batches = job_queue.unfinished_batches()
+        if not batches:
+            return
+
+        remaining = sum(b['remaining'] for b in batches)
+        reply = QMessageBox.question(
+            self, "Незавершённые пакеты",
+            f"Найдено незавершённых пакетов: {len(batches)} (осталось изображений: {remaining}).\n"
+            "Продолжить генерацию с того места, где она остановилась?",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+
+        if reply == QMessageBox.Yes:
+            # Продолжаемые пакеты выполняются в фоне и не задерживают новые
+            for batch in batches:
+                self.start_worker(DownloadImageWorker.from_batch(job_queue, batch['id'], PRIORITY_BACKGROUND))
         else:
-            self.progress_bar.setFormat("✅ Готово!")
+            for batch in batches:
+                job_queue.finish_batch(batch['id'], BATCH_CANCELLED)
 
     def show_generation_error(self, error_msg):
         """Показывает ошибку генерации"""
-        print(f"Ошибка генерации: {error_msg}")
+        # Ошибка уже записана в журнал генератором; здесь только отметка о получении интерфейсом
+        logger.debug("Интерфейс получил ошибку генерации: %s", error_msg)
+
+    def download_finished(self, success, failed_images, summary):
+        """Обработка завершения пакета"""
+        worker = self.sender()
+        if worker is not None and worker.cancelled:
+            return
 
-    def download_finished(self, success, failed_images):
-        """Обработка завершения генерации"""
-        self.set_ui_enabled(True)
-        
         if success and not failed_images:
-            self.progress_bar.setFormat("✅ Все изображения готовы!")
             QMessageBox.information(
                 self, "🎉 Успех!", 
                 "Все изображения успешно сгенерированы и сохранены!"
             )
         elif failed_images:
             failed_count = len(failed_images)
-            self.progress_bar.setFormat(f"⚠️ Готово с ошибками ({failed_count})")
             
             msg = f"Генерация завершена, но {failed_count} изображений не удалось создать:\n\n"
             for i, fail in enumerate(failed_images[:5]):
@@ -712,7 +1325,6 @@ class ImageDownloaderApp(QWidget):
                 
             QMessageBox.warning(self, "⚠️ Завершено с ошибками", msg)
         else:
-            self.progress_bar.setFormat("❌ Ошибка!")
             QMessageBox.critical(
                 self, "❌ Критическая ошибка",
                 "Произошла критическая ошибка во время генерации."
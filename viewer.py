@@ -1,10 +1,47 @@
+import logging
 import os
+import time
+from collections import deque
 from PySide6.QtWidgets import (
     QScrollArea, QWidget, QVBoxLayout, QMenu, QDialog, QLabel, QHBoxLayout, QPushButton, QApplication,
     QMessageBox
 )
-from PySide6.QtCore import Qt, Signal, QSize
-from PySide6.QtGui import QPixmap, QMouseEvent, QIcon
+from PySide6.QtCore import Qt, Signal, QSize, QTimer
+from PySide6.QtGui import QPixmap, QMouseEvent, QIcon, QImageReader
+
+from catalog import get_catalog
+from thumbnails import remove_thumbnail, thumbnail_path
+
+
+logger = logging.getLogger(__name__)
+
+ADD_IMAGES_BUDGET = 0.012  # секунд на добавление миниатюр за один проход цикла событий
+
+
+def load_thumbnail(image_path, size):
+    """
+    Уменьшенная копия изображения для галереи без декодирования исходника
+    в полном размере: берётся миниатюра, сохранённая при генерации, а если её
+    нет или она устарела — изображение читается сразу в уменьшенном размере.
+    :return: (QPixmap, QSize исходного изображения); при ошибке QPixmap пустой
+    """
+    reader = QImageReader(image_path)
+    original_size = reader.size()  # читается только заголовок файла
+    thumb_path = thumbnail_path(image_path)
+    try:
+        fresh = os.path.getmtime(thumb_path) >= os.path.getmtime(image_path)
+    except OSError:
+        fresh = False
+    if fresh:
+        pixmap = QPixmap(thumb_path)
+        if not pixmap.isNull():
+            if pixmap.width() > size.width() or pixmap.height() > size.height():
+                pixmap = pixmap.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            return pixmap, original_size
+
+    if original_size.isValid() and (original_size.width() > size.width() or original_size.height() > size.height()):
+        reader.setScaledSize(original_size.scaled(size, Qt.KeepAspectRatio))
+    return QPixmap.fromImage(reader.read()), original_size
 
 
 def clamp_index(index, maximum):
@@ -115,11 +152,14 @@ class ImageViewerDialog(QDialog):
 class ImageItemWidget(QWidget):
     request_delete = Signal(object)
 
-    def __init__(self, image_path, preview_widget, parent=None):
+    def __init__(self, image_path, preview_widget, parent=None, draft=None):
+        """:param draft: задание черновика (prompt, model, seed, итоговые width и height) или None"""
         super().__init__(parent)
         self.image_path = image_path
         self.preview_widget = preview_widget
         self.selected = False
+        self.draft = None
+        self.final_requested = False
 
         self.layout = QVBoxLayout(self)
         self.layout.setContentsMargins(2, 2, 2, 2)
@@ -129,16 +169,14 @@ class ImageItemWidget(QWidget):
         self.label.setAlignment(Qt.AlignCenter)
         self.layout.addWidget(self.label)
 
+        self.draft_label = QLabel("Черновик", self)
+        self.draft_label.setStyleSheet(
+            "QLabel { background-color: rgba(0, 0, 0, 0.6); color: white; border: none; border-radius: 4px; "
+            "padding: 2px 6px; font-size: 11px; }")
+        self.draft_label.move(6, 6)
+
         self.thumbnail_size = QSize(280, 280)
-        pixmap = QPixmap(self.image_path)
-        if not pixmap.isNull():
-            thumbnail = pixmap.scaled(self.thumbnail_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            self.label.setPixmap(thumbnail)
-            self.setToolTip(
-                f"{os.path.basename(image_path)}\n{pixmap.width()}x{pixmap.height()} px")
-        else:
-            self.label.setText(f"Не удалось\nзагрузить\n{os.path.basename(image_path)}")
-            self.setToolTip(f"Ошибка загрузки: {os.path.basename(image_path)}")
+        self.set_image(image_path, draft)
 
         self.delete_button = QPushButton("✖")
         self.delete_button.setFlat(True)
@@ -164,6 +202,24 @@ class ImageItemWidget(QWidget):
 
         self.update_style()
 
+    def set_image(self, image_path, draft=None):
+        """Показывает изображение; итоговое изображение заменяет черновик на том же месте."""
+        self.image_path = image_path
+        self.draft = draft
+        thumbnail, original_size = load_thumbnail(image_path, self.thumbnail_size)
+        if not thumbnail.isNull():
+            self.label.setPixmap(thumbnail)
+            tooltip = f"{os.path.basename(image_path)}\n{original_size.width()}x{original_size.height()} px"
+            if draft is not None:
+                tooltip += f"\nЧерновик, итоговый размер {draft['width']}x{draft['height']} px"
+            self.setToolTip(tooltip)
+        else:
+            self.label.setText(f"Не удалось\nзагрузить\n{os.path.basename(image_path)}")
+            self.setToolTip(f"Ошибка загрузки: {os.path.basename(image_path)}")
+        self.draft_label.setVisible(draft is not None)
+        self.draft_label.adjustSize()
+        self.draft_label.raise_()
+
     def resizeEvent(self, event):
         super().resizeEvent(event)
         self.delete_button.move(self.width() - self.delete_button.width() - 3, 3)
@@ -190,12 +246,12 @@ class ImageItemWidget(QWidget):
                     dialog = ImageViewerDialog(all_visible_widgets, current_index=index, parent=self.preview_widget)
                     dialog.exec_()
                 else:
-                    print("Ошибка: элемент не найден в списке видимых виджетов.")
+                    logger.warning("Элемент не найден в списке видимых виджетов", extra={'path': self.image_path})
 
             except ValueError:
-                print("Ошибка: не удалось найти индекс элемента в списке видимых.")
+                logger.warning("Не удалось найти индекс элемента в списке видимых", extra={'path': self.image_path})
             except Exception as e:
-                print(f"Ошибка при открытии диалога: {e}")
+                logger.exception("Ошибка при открытии диалога: %s", e, extra={'path': self.image_path})
 
     def set_selected(self, selected: bool):
         if self.selected != selected:
@@ -217,6 +273,7 @@ class ImageItemWidget(QWidget):
 
 
 class ImagePreviewWidget(QScrollArea):
+    finals_requested = Signal(list)  # задания черновиков (с draft_path), для которых нужен итоговый размер
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -234,20 +291,78 @@ class ImagePreviewWidget(QScrollArea):
         self.selected_items = []
         self.last_selected_item = None
 
+        self._pending_paths = deque()  # (путь, задание черновика или None)
+        self._draft_items = {}
+        self._finalized = {}  # черновик, ещё ожидающий добавления -> итоговое изображение
+        self._add_timer = QTimer(self)
+        self._add_timer.setSingleShot(True)
+        self._add_timer.setInterval(0)
+        self._add_timer.timeout.connect(self._add_pending)
+
     def add_image(self, image_path):
-        if not os.path.exists(image_path):
-            print(f"Предупреждение: Попытка добавить несуществующий файл: {image_path}")
-            return
+        self.add_images([image_path])
+
+    def add_images(self, image_paths):
+        """
+        Добавляет изображения. Виджеты создаются порциями не дольше
+        ADD_IMAGES_BUDGET, каждая порция — один проход раскладки и перерисовки;
+        остаток добавляется на следующих итерациях цикла событий, чтобы
+        интерфейс оставался отзывчивым, даже когда результаты приходят сотнями.
+        """
+        self._pending_paths.extend((path, None) for path in image_paths)
+        if not self._add_timer.isActive():
+            self._add_pending()
+
+    def add_drafts(self, drafts):
+        """Добавляет черновики: [(путь, задание)]."""
+        self._pending_paths.extend(drafts)
+        if not self._add_timer.isActive():
+            self._add_pending()
+
+    def finalize_drafts(self, pairs):
+        """Заменяет черновики итоговыми изображениями: [(путь черновика, путь итогового)]."""
+        new_images = []
+        for draft_path, path in pairs:
+            item = self._draft_items.pop(draft_path, None)
+            if item is not None:
+                item.set_image(path)
+            elif any(pending == draft_path for pending, _ in self._pending_paths):
+                self._finalized[draft_path] = path
+            else:
+                new_images.append(path)  # черновик уже удалён из галереи
+        if new_images:
+            self.add_images(new_images)
 
-        item = ImageItemWidget(image_path, preview_widget=self)
-        item.request_delete.connect(self.remove_image_widget)
-        self.main_layout.addWidget(item)
-        self._items.append(item)
+    def _add_pending(self):
+        deadline = time.perf_counter() + ADD_IMAGES_BUDGET
+        self.main_widget.setUpdatesEnabled(False)
+        try:
+            while self._pending_paths and time.perf_counter() < deadline:
+                image_path, draft = self._pending_paths.popleft()
+                if draft is not None and image_path in self._finalized:
+                    image_path, draft = self._finalized.pop(image_path), None
+                if image_path.endswith(".part"):
+                    # Недокачанные временные файлы воркера никогда не показываем
+                    continue
+                if not os.path.exists(image_path):
+                    logger.warning("Попытка добавить несуществующий файл", extra={'path': image_path})
+                    continue
+
+                item = ImageItemWidget(image_path, preview_widget=self, draft=draft)
+                item.request_delete.connect(self.remove_image_widget)
+                if draft is not None:
+                    self._draft_items[image_path] = item
+                self.main_layout.addWidget(item)
+                self._items.append(item)
+        finally:
+            self.main_widget.setUpdatesEnabled(True)
+        if self._pending_paths:
+            self._add_timer.start()
 
     def remove_image_widget(self, item_widget):
         """Удаляет виджет изображения и сам файл."""
         if item_widget not in self._items:
-            print("Предупреждение: Попытка удалить уже удаленный виджет.")
+            logger.debug("Попытка удалить уже удалённый виджет", extra={'path': item_widget.image_path})
             return
 
         reply = QMessageBox.question(self, "Подтверждение удаления",
@@ -259,9 +374,12 @@ class ImagePreviewWidget(QScrollArea):
                 image_path_to_delete = item_widget.image_path
                 if os.path.exists(image_path_to_delete):
                     os.remove(image_path_to_delete)
-                    print(f"Файл удален: {image_path_to_delete}")
+                    logger.info("Файл удалён", extra={'path': image_path_to_delete})
+                remove_thumbnail(image_path_to_delete)
+                get_catalog().remove([image_path_to_delete])
 
                 self._items.remove(item_widget)
+                self._draft_items.pop(image_path_to_delete, None)
                 if item_widget in self.selected_items:
                     self.selected_items.remove(item_widget)
                     if self.last_selected_item == item_widget:
@@ -272,10 +390,10 @@ class ImagePreviewWidget(QScrollArea):
 
             except OSError as e:
                 QMessageBox.warning(self, "Ошибка удаления файла", f"Не удалось удалить файл:\n{e}")
-                print(f"Ошибка удаления файла {image_path_to_delete}: {e}")
+                logger.error("Ошибка удаления файла: %s", e, extra={'path': image_path_to_delete})
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка", f"Произошла ошибка при удалении: {e}")
-                print(f"Неожиданная ошибка при удалении {image_path_to_delete}: {e}")
+                logger.exception("Неожиданная ошибка при удалении: %s", e, extra={'path': image_path_to_delete})
 
     def toggle_item_selection(self, item):
         """Переключает выделение для одного элемента."""
@@ -313,14 +431,14 @@ class ImagePreviewWidget(QScrollArea):
             return
 
         if target_item not in self._items:
-            print("Ошибка: целевой элемент для выделения диапазона не найден.")
+            logger.debug("Целевой элемент для выделения диапазона не найден")
             return
 
         try:
             start_index = self._items.index(self.last_selected_item)
             end_index = self._items.index(target_item)
         except ValueError:
-            print("Ошибка: один из элементов для выделения диапазона не найден в _items.")
+            logger.debug("Один из элементов для выделения диапазона не найден в _items")
             return
 
         if start_index > end_index:
@@ -358,6 +476,10 @@ class ImagePreviewWidget(QScrollArea):
             return
 
         menu = QMenu(self)
+        drafts = [item for item in self.selected_items if item.draft is not None and not item.final_requested]
+        final_action = None
+        if drafts:
+            final_action = menu.addAction(f"Итоговый размер для черновиков ({len(drafts)})")
         delete_action = menu.addAction(f"Удалить выбранные ({len(self.selected_items)})")
         open_folder_action = None
         if len(self.selected_items) == 1:
@@ -368,7 +490,12 @@ class ImagePreviewWidget(QScrollArea):
 
         action = menu.exec_(event.globalPos())
 
-        if action == delete_action:
+        if action is not None and action == final_action:
+            for item in drafts:
+                item.final_requested = True
+            self.finals_requested.emit([dict(item.draft, draft_path=item.image_path) for item in drafts])
+
+        elif action == delete_action:
             items_to_delete = list(self.selected_items)
             count = len(items_to_delete)
 
@@ -378,6 +505,7 @@ class ImagePreviewWidget(QScrollArea):
 
             if reply == QMessageBox.Yes:
                 deleted_count = 0
+                deleted_paths = []
                 error_messages = []
                 for item in items_to_delete:
                     try:
@@ -385,8 +513,11 @@ class ImagePreviewWidget(QScrollArea):
                             image_path_to_delete = item.image_path
                             if os.path.exists(image_path_to_delete):
                                 os.remove(image_path_to_delete)
+                            remove_thumbnail(image_path_to_delete)
+                            deleted_paths.append(image_path_to_delete)
 
                             self._items.remove(item)
+                            self._draft_items.pop(image_path_to_delete, None)
                             if item in self.selected_items:
                                 self.selected_items.remove(item)
 
@@ -394,15 +525,17 @@ class ImagePreviewWidget(QScrollArea):
                             item.deleteLater()
                             deleted_count += 1
                         else:
-                            print(f"Предупреждение: Попытка удалить элемент {item}, который уже не в списке _items.")
+                            logger.debug("Попытка удалить элемент, которого уже нет в списке",
+                                         extra={'path': item.image_path})
 
 
                     except Exception as e:
                         error_msg = f"Не удалось удалить {os.path.basename(item.image_path)}: {e}"
-                        print(error_msg)
+                        logger.error(error_msg, extra={'path': item.image_path})
                         error_messages.append(error_msg)
 
-                print(f"Удалено {deleted_count} из {count} выбранных файлов.")
+                get_catalog().remove(deleted_paths)
+                logger.info("Удалено %d из %d выбранных файлов", deleted_count, count)
                 if error_messages:
                     QMessageBox.warning(self, "Ошибки при удалении", "\n".join(error_messages))
 